@@ -0,0 +1,177 @@
+"""Aperture photometry benchmarks, run with asv.
+
+A synthetic frame is generated once per star count and kept between runs
+in $SHUTTERBUG_BENCH_DATA, like the pipeline benchmarks' exports.
+"""
+
+import logging
+import os
+import warnings
+
+import numpy as np
+from astropy.io import fits
+from photutils.aperture import CircularAnnulus
+
+from benchmarks.pipeline import DATA_DIR
+from shutterbug.core.utility.photometry import (
+    BACKGROUND_METHODS,
+    annulus_background,
+    annulus_background_list,
+    annulus_backgrounds,
+    growth_radii,
+    measure_curves_of_growth,
+    measure_frame_magnitudes,
+    measure_frames,
+    measure_star_magnitude,
+    measure_star_magnitudes,
+)
+from shutterbug.reduction import ReductionParameters, detect_stars, load_frame
+from shutterbug.synthetic import generate_fits_frames
+
+logging.disable(logging.INFO)
+
+STARS = [100, 1500]
+FRAME_SIZE = 2048
+ANNULUS_INNER = 15
+ANNULUS_OUTER = 20
+# Series measured by "Photometry All Images"
+SERIES_FRAMES = 40
+SERIES_STARS = 1000
+
+
+def synthetic_frame(stars):
+    """Image data and positions of the brightest stars of a synthetic frame."""
+    directory = DATA_DIR / f"frame_{stars}"
+    path = directory / "frame_0000.fits"
+    if not path.exists():
+        directory.mkdir(parents=True, exist_ok=True)
+        (path,) = generate_fits_frames(
+            directory, n_stars=stars, n_frames=1, size=FRAME_SIZE, seed=stars
+        )
+    data, _ = load_frame(path)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        positions = detect_stars(data, ReductionParameters())
+    # Brightest first, so this drops the noise peaks like --max-stars
+    return data, positions[:stars]
+
+
+class AnnulusBackground:
+    params = STARS
+    param_names = ["stars"]
+    timeout = 600
+
+    def setup(self, stars):
+        self.data, self.positions = synthetic_frame(stars)
+        self.annulus = CircularAnnulus(
+            self.positions, r_in=ANNULUS_INNER, r_out=ANNULUS_OUTER
+        )
+        self.annuli = [
+            CircularAnnulus([position], r_in=ANNULUS_INNER, r_out=ANNULUS_OUTER)
+            for position in self.positions
+        ]
+
+    def time_list_per_star(self, stars):
+        for annulus in self.annuli:
+            annulus_background_list(annulus, self.data)
+
+    def time_pooled_per_star(self, stars):
+        for annulus in self.annuli:
+            annulus_background(annulus, self.data)
+
+    def time_vectorized(self, stars):
+        annulus_backgrounds(self.annulus, self.data)
+
+    def time_vectorized_median(self, stars):
+        annulus_backgrounds(self.annulus, self.data, method="median")
+
+    def time_vectorized_mode(self, stars):
+        annulus_backgrounds(self.annulus, self.data, method="mode")
+
+
+class Photometry:
+    params = STARS
+    param_names = ["stars"]
+    timeout = 600
+
+    def setup(self, stars):
+        self.data, self.positions = synthetic_frame(stars)
+
+    def time_measure_star_magnitude_per_star(self, stars):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for x, y in self.positions:
+                measure_star_magnitude(x, y, self.data)
+
+    def time_measure_star_magnitudes(self, stars):
+        measure_star_magnitudes(self.positions, self.data)
+
+
+class CurveOfGrowth:
+    params = STARS
+    param_names = ["stars"]
+    timeout = 600
+
+    def setup(self, stars):
+        self.data, self.positions = synthetic_frame(stars)
+        self.radii = growth_radii(ANNULUS_INNER)
+
+    def time_per_radius(self, stars):
+        for radius in self.radii:
+            measure_star_magnitudes(self.positions, self.data, aperture_radius=radius)
+
+    def time_single_pass(self, stars):
+        measure_curves_of_growth(self.positions, self.data, self.radii)
+
+
+class PhotometryAllImages:
+    """Measuring a series of frames serially and on worker processes"""
+
+    params = sorted({1, os.cpu_count() or 1})
+    param_names = ["jobs"]
+    timeout = 1200
+
+    def setup_cache(self):
+        directory = DATA_DIR / f"series_{SERIES_FRAMES}"
+        paths = sorted(directory.glob("frame_*.fits"))
+        if len(paths) != SERIES_FRAMES:
+            directory.mkdir(parents=True, exist_ok=True)
+            paths = generate_fits_frames(
+                directory, n_stars=SERIES_STARS, n_frames=SERIES_FRAMES, size=1024
+            )
+        data, _ = load_frame(paths[0])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            positions = detect_stars(data, ReductionParameters())[:SERIES_STARS]
+        # Synthetic frames are unsigned, stored with a BZERO offset
+        bzeros = [fits.getheader(path).get("BZERO", 0) for path in paths]
+        return paths, positions, bzeros
+
+    def setup(self, cache, jobs):
+        self.paths, self.positions, self.bzeros = cache
+
+    def time_measure_frames(self, cache, jobs):
+        n = len(self.paths)
+        if jobs == 1:
+            for path, bzero in zip(self.paths, self.bzeros):
+                measure_frame_magnitudes(path, self.positions, bzero=bzero)
+        else:
+            list(
+                measure_frames(
+                    self.paths, [self.positions] * n, self.bzeros, [1] * n, jobs
+                )
+            )
+
+
+if __name__ == "__main__":
+    # Quick comparison without asv
+    import timeit
+
+    for stars in STARS:
+        bench = AnnulusBackground()
+        bench.setup(stars)
+        for method in ["time_list_per_star", "time_vectorized"]:
+            seconds = min(
+                timeit.repeat(lambda: getattr(bench, method)(stars), number=1, repeat=3)
+            )
+            print(f"{stars:5d} stars  {method:20s} {seconds * 1000:8.1f} ms")
+    print(f"Estimators: {', '.join(BACKGROUND_METHODS)}")
@@ -0,0 +1,137 @@
+"""Scaling benchmarks for the shutterbug CLI pipeline, run with asv.
+
+Synthetic exports are generated once per size and kept between runs in
+$SHUTTERBUG_BENCH_DATA (default: a shutterbug-bench temporary directory).
+"""
+
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from shutterbug.csv_loader import (
+    load_mirax_export,
+    load_observation_data,
+    load_spatial_metadata,
+)
+from shutterbug.differential import (
+    calculate_all_differential_magnitudes,
+    calculate_differential_magnitudes,
+    calculate_weighted_differential_magnitudes,
+    find_all_reference_stars,
+    find_reference_stars,
+)
+from shutterbug.synthetic import generate_mirax_export
+from shutterbug.utility import split_by_session
+
+logging.disable(logging.INFO)
+
+STARS = [100, 1000, 10000]
+EPOCHS = [100, 1000]
+DATA_DIR = Path(
+    os.environ.get(
+        "SHUTTERBUG_BENCH_DATA", Path(tempfile.gettempdir()) / "shutterbug-bench"
+    )
+)
+
+
+def synthetic_export(stars, epochs):
+    """Path to a synthetic export of the given size, generating it if needed."""
+    path = DATA_DIR / f"mirax_{stars}x{epochs}.csv"
+    if not path.exists():
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix(".partial")
+        generate_mirax_export(partial, n_stars=stars, n_epochs=epochs, seed=stars)
+        partial.rename(path)
+    return path
+
+
+class Loading:
+    params = (STARS, EPOCHS)
+    param_names = ["stars", "epochs"]
+    timeout = 1800
+
+    def setup(self, stars, epochs):
+        self.path = synthetic_export(stars, epochs)
+
+    def time_load_observation_data(self, stars, epochs):
+        load_observation_data(self.path)
+
+    def peakmem_load_observation_data(self, stars, epochs):
+        load_observation_data(self.path)
+
+    def time_load_spatial_metadata(self, stars, epochs):
+        load_spatial_metadata(self.path)
+
+    def time_load_mirax_export(self, stars, epochs):
+        load_mirax_export(self.path)
+
+    def peakmem_load_mirax_export(self, stars, epochs):
+        load_mirax_export(self.path)
+
+
+class ReferenceSelection:
+    params = STARS
+    param_names = ["stars"]
+    timeout = 600
+
+    def setup(self, stars):
+        self.metadata = load_spatial_metadata(synthetic_export(stars, EPOCHS[0]))
+        self.target = self.metadata["Name"].iloc[0]
+
+    def time_find_reference_stars_one_target(self, stars):
+        find_reference_stars(self.metadata, self.target)
+
+    def time_find_all_reference_stars(self, stars):
+        find_all_reference_stars(self.metadata)
+
+
+class Differential:
+    params = (STARS, EPOCHS)
+    param_names = ["stars", "epochs"]
+    timeout = 1800
+
+    def setup(self, stars, epochs):
+        self.data, metadata = load_mirax_export(synthetic_export(stars, epochs))
+        self.names = metadata["Name"].tolist()
+        self.reference_indices = find_all_reference_stars(metadata)
+        self.target = self.names[0]
+        self.reference_names = [
+            self.names[i] for i in self.reference_indices[0] if i >= 0
+        ]
+
+    def time_calculate_differential_magnitudes_one_target(self, stars, epochs):
+        calculate_differential_magnitudes(self.data, self.target, self.reference_names)
+
+    def time_calculate_all_differential_magnitudes(self, stars, epochs):
+        calculate_all_differential_magnitudes(
+            self.data, self.names, self.reference_indices
+        )
+
+    def peakmem_calculate_all_differential_magnitudes(self, stars, epochs):
+        calculate_all_differential_magnitudes(
+            self.data, self.names, self.reference_indices
+        )
+
+    def time_calculate_weighted_differential_magnitudes(self, stars, epochs):
+        calculate_weighted_differential_magnitudes(
+            self.data, self.names, self.reference_indices
+        )
+
+
+class Sessions:
+    params = (STARS, EPOCHS)
+    param_names = ["stars", "epochs"]
+    timeout = 1800
+
+    def setup(self, stars, epochs):
+        data, metadata = load_mirax_export(synthetic_export(stars, epochs))
+        self.diff_data = calculate_all_differential_magnitudes(
+            data, metadata["Name"].tolist(), find_all_reference_stars(metadata)
+        )
+
+    def time_split_by_session(self, stars, epochs):
+        split_by_session(self.diff_data)
+
+    def peakmem_split_by_session(self, stars, epochs):
+        split_by_session(self.diff_data)
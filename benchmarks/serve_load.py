@@ -0,0 +1,141 @@
+"""Load test for ``shutterbug serve``.
+
+Serves a results file or dataset from this process on a free local port, or
+targets a running server with --url, then requests random light curves,
+rankings and session lists from several client threads over keep-alive
+connections, reporting throughput and latency percentiles per endpoint:
+
+    python benchmarks/serve_load.py results.csv --clients 8 --requests 5000
+    python benchmarks/serve_load.py --url http://127.0.0.1:8765 --format arrow
+
+Use --cache-size 0 to measure uncached queries.
+"""
+
+import http.client
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+import click
+import numpy as np
+
+# Share of requests going to each endpoint
+QUERY_MIX = {"/curve": 0.8, "/ranking": 0.1, "/sessions": 0.1}
+
+
+def run_clients(url, stars, n_requests, n_clients, response_format, seed=0):
+    """Send requests from ``n_clients`` threads, returning latencies by endpoint."""
+    address = urlsplit(url)
+    paths = list(QUERY_MIX)
+    weights = list(QUERY_MIX.values())
+    latencies = defaultdict(list)
+    errors = []
+    lock = threading.Lock()
+
+    def client(number):
+        rng = random.Random(seed + number)
+        connection = http.client.HTTPConnection(address.hostname, address.port)
+        local = defaultdict(list)
+        for _ in range(n_requests // n_clients):
+            path = rng.choices(paths, weights)[0]
+            if path == "/curve":
+                query = f"{path}?star={quote(rng.choice(stars))}"
+            elif path == "/ranking":
+                query = f"{path}?top_k=50"
+            else:
+                query = path
+            query += ("&" if "?" in query else "?") + f"format={response_format}"
+            start = time.perf_counter()
+            connection.request("GET", query)
+            response = connection.getresponse()
+            response.read()
+            local[path].append(time.perf_counter() - start)
+            if response.status != 200:
+                with lock:
+                    errors.append(f"{query}: {response.status}")
+        connection.close()
+        with lock:
+            for path, values in local.items():
+                latencies[path].extend(values)
+
+    with ThreadPoolExecutor(max_workers=n_clients) as executor:
+        list(executor.map(client, range(n_clients)))
+    return latencies, errors
+
+
+def fetch_stars(url):
+    """Names of the stars the server has results for."""
+    address = urlsplit(url)
+    connection = http.client.HTTPConnection(address.hostname, address.port)
+    connection.request("GET", "/stars")
+    stars = [row["Name"] for row in json.loads(connection.getresponse().read())]
+    connection.close()
+    return stars
+
+
+@click.command()
+@click.argument("results", required=False, type=click.Path(exists=True))
+@click.option("--url", default=None, help="Test a running server instead.")
+@click.option("--clients", default=8, show_default=True, help="Client threads.")
+@click.option("--requests", "n_requests", default=2000, show_default=True)
+@click.option(
+    "--format",
+    "response_format",
+    type=click.Choice(["json", "arrow"]),
+    default="json",
+    show_default=True,
+)
+@click.option(
+    "--cache-size",
+    default=1024,
+    show_default=True,
+    help="Response cache size of the server started for RESULTS.",
+)
+def main(results, url, clients, n_requests, response_format, cache_size):
+    """Measure query throughput and latency of the results server."""
+    if (results is None) == (url is None):
+        raise click.UsageError("Give either RESULTS or --url")
+
+    server = None
+    if url is None:
+        from shutterbug.server import ResultsServer, ResultsService
+
+        service = ResultsService(results, cache_size=cache_size)
+        server = ResultsServer(("127.0.0.1", 0), service)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    try:
+        stars = fetch_stars(url)
+        start = time.perf_counter()
+        latencies, errors = run_clients(
+            url, stars, n_requests, clients, response_format
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    total = sum(len(values) for values in latencies.values())
+    click.echo(
+        f"{total} requests from {clients} clients in {elapsed:.2f}s: "
+        f"{total / elapsed:.0f} requests/s"
+    )
+    for path, values in sorted(latencies.items()):
+        p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+        click.echo(
+            f"{path:10} {len(values):6d} requests  p50 {p50:6.2f} ms  "
+            f"p95 {p95:6.2f} ms  p99 {p99:6.2f} ms"
+        )
+    if errors:
+        click.echo(f"{len(errors)} failed requests, first: {errors[0]}", err=True)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Start-up benchmarks for the shutterbug CLI.
+
+The asv ``timeraw_`` benchmarks time a fresh interpreter. Running this file
+directly checks the import-time regression budget with ``python -X
+importtime``, failing if importing the CLI takes too long or pulls in the
+scientific stack:
+
+    python benchmarks/startup.py --budget-ms 150
+"""
+
+import subprocess
+import sys
+
+import click
+
+# Modules that must not be imported until a command actually runs
+HEAVY_MODULES = ["numpy", "pandas", "scipy", "matplotlib", "astropy", "photutils"]
+IMPORT_BUDGET_MS = 150
+
+
+def timeraw_import_cli():
+    return "import shutterbug.cli"
+
+
+def timeraw_cli_help():
+    return """
+    from shutterbug.cli import cli
+    try:
+        cli(["--help"])
+    except SystemExit:
+        pass
+    """
+
+
+def measure_import(module="shutterbug.cli"):
+    """Cumulative import time of a module in ms, and the top-level modules it loads."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total_us = None
+    loaded = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        loaded.add(name.split(".")[0])
+        if name == module:
+            total_us = int(cumulative)
+    return total_us / 1000, loaded
+
+
+@click.command()
+@click.option(
+    "--budget-ms",
+    type=float,
+    default=IMPORT_BUDGET_MS,
+    show_default=True,
+    help="Maximum cumulative import time of shutterbug.cli.",
+)
+@click.option("--repeat", default=5, show_default=True, help="Best of this many runs.")
+def main(budget_ms, repeat):
+    """Check shutterbug.cli against its import-time budget."""
+    runs = [measure_import() for _ in range(repeat)]
+    best_ms = min(ms for ms, _ in runs)
+    heavy = sorted(set(HEAVY_MODULES) & runs[0][1])
+
+    click.echo(f"shutterbug.cli imports in {best_ms:.1f} ms (budget {budget_ms} ms)")
+    failed = False
+    if heavy:
+        click.echo(f"Scientific modules imported at start-up: {', '.join(heavy)}")
+        failed = True
+    if best_ms > budget_ms:
+        click.echo("Import time is over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,70 +1,669 @@
 import logging
 
 import click
-import pandas as pd
 
-from shutterbug.csv_loader import load_observation_data, load_spatial_metadata
-from shutterbug.differential import (
-    calculate_differential_magnitudes,
-    find_reference_stars,
+# The scientific stack is only imported once a command actually runs, so
+# --help and argument errors stay fast. Keep module-level imports light.
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def _parse_memory_limit(ctx, param, value):
+    """Click callback turning a size such as '4G' or '512MiB' into bytes."""
+    if value is None:
+        return None
+    text = str(value).strip().upper().removesuffix("B").removesuffix("I")
+    number, unit = text, ""
+    if text and text[-1] in SIZE_UNITS:
+        number, unit = text[:-1], text[-1]
+    try:
+        size = int(float(number) * SIZE_UNITS[unit])
+    except ValueError:
+        raise click.BadParameter(f"Invalid size: {value}")
+    if size <= 0:
+        raise click.BadParameter(f"Size must be positive: {value}")
+    return size
+
+
+# Options shared by the default command and the subcommands
+ENSEMBLE_OPTION = click.option(
+    "--ensemble",
+    type=click.Choice(["mean", "weighted"]),
+    default="mean",
+    show_default=True,
+    help=(
+        "How reference stars are combined: a plain mean, or an inverse-variance "
+        "weighted mean that iteratively drops references with excess scatter."
+    ),
+)
+CLIP_SIGMA_OPTION = click.option(
+    "--clip-sigma",
+    type=click.FloatRange(min=0, min_open=True),
+    default=3.0,
+    show_default=True,
+    help="Clipping threshold for --ensemble weighted, in robust deviations.",
+)
+TOP_K_OPTION = click.option(
+    "--top-k",
+    type=click.IntRange(min=0),
+    default=None,
+    help="Only plot this many of the most variable light curves.",
+)
+REFERENCES_OPTION = click.option(
+    "--references",
+    "references_file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help=(
+        "CSV of fixed reference stars for each target, as saved by "
+        "'shutterbug references', instead of selecting them by position."
+    ),
+)
+NO_PROGRESS_OPTION = click.option(
+    "--no-progress",
+    is_flag=True,
+    help="Hide the progress bars. They are hidden anyway when not on a terminal.",
+)
+MIN_SCORE_OPTION = click.option(
+    "--min-score",
+    type=float,
+    default=None,
+    help=(
+        "Only plot light curves with at least this variability score, in "
+        "robust deviations from a typical star in the same session."
+    ),
 )
-from shutterbug.graph import plot_light_curve
-from shutterbug.utility import split_by_session
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option(
     "--data-file",
-    type=click.Path(exists=True),
-    required=True,
-    help="Path to the CSV file containing observation data.",
+    "data_files",
+    multiple=True,
+    help=(
+        "CSV or Excel (.xlsx) file containing observation data. May be "
+        "repeated, and may be a glob pattern or a directory of exports."
+    ),
+)
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    default=".",
+    show_default=True,
+    help="Directory for light curves. Each of several files gets a subdirectory.",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(["c", "python", "pyarrow"]),
+    default="c",
+    show_default=True,
+    help="CSV parser engine. pyarrow must be installed separately.",
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Read and clean the CSV this many rows at a time to bound memory use.",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help=(
+        "Always parse the CSV and select reference stars, without reading or "
+        "writing the sidecar or reference star caches."
+    ),
+)
+@click.option(
+    "--rebuild-cache",
+    is_flag=True,
+    help="Parse the CSV and overwrite any existing sidecar cache.",
+)
+@REFERENCES_OPTION
+@ENSEMBLE_OPTION
+@CLIP_SIGMA_OPTION
+@TOP_K_OPTION
+@MIN_SCORE_OPTION
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help=(
+        "Number of worker processes. Used to render light curves for a single "
+        "file, or to process several files in parallel."
+    ),
+)
+@click.option(
+    "--results-file",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help=(
+        "CSV file to write the differential magnitudes to. With several files, "
+        "written under each file's output subdirectory."
+    ),
+)
+@click.option(
+    "--results-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help=(
+        "Parquet dataset, partitioned by session and star, to add the "
+        "differential magnitudes to. Requires pyarrow."
+    ),
+)
+@click.option(
+    "--memory-limit",
+    callback=_parse_memory_limit,
+    default=None,
+    help=(
+        "Process the export out of core in JD windows sized to fit this much "
+        "memory, e.g. 4G."
+    ),
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help=(
+        "Only process sessions that are new or changed since the last "
+        "incremental run into the output directory, merging them into the "
+        "existing results."
+    ),
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help=(
+        "Time each pipeline stage and write rows/sec and peak memory to "
+        "profile.json in the output directory."
+    ),
+)
+@click.option(
+    "--profile-stats",
+    is_flag=True,
+    help=(
+        "With --profile, also run stages under cProfile and write the slowest "
+        "stage's stats to profile_slowest.prof."
+    ),
 )
-def cli(data_file):
-    """Command-line interface for calculating differential magnitudes."""
+@NO_PROGRESS_OPTION
+@click.pass_context
+def cli(
+    ctx,
+    data_files,
+    output_dir,
+    engine,
+    chunk_size,
+    no_cache,
+    rebuild_cache,
+    references_file,
+    ensemble,
+    clip_sigma,
+    top_k,
+    min_score,
+    jobs,
+    results_file,
+    results_dir,
+    memory_limit,
+    incremental,
+    profile,
+    profile_stats,
+    no_progress,
+):
+    """Command-line interface for calculating differential magnitudes.
+
+    Processes the exports given with --data-file, or runs one of the
+    commands below.
+    """
     # Set up logging
     logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    # Load data and set up empty DataFrame for results
-    logger.info(f"Loading observation data from {data_file}")
-    data = load_observation_data(data_file)
-    metadata = load_spatial_metadata(data_file)
-    logger.info("Data loaded successfully.")
-    diff_data = pd.DataFrame()
-
-    # Iterate over each star in the dataset, find reference stars, and calculate differential magnitudes
-    for star in metadata["Name"].unique():
-        target_star = star
-        logger.debug(f"Finding reference stars for target star {target_star}")
-        reference_stars = find_reference_stars(metadata, target_star)
-
-        # Calculate differential magnitudes
-        logger.info(
-            f"Calculating differential magnitudes for target star {target_star}"
+
+    if ctx.invoked_subcommand is not None:
+        return
+    if not data_files:
+        raise click.UsageError("Missing option '--data-file'.")
+    if incremental and memory_limit is not None:
+        raise click.UsageError("--incremental cannot be combined with --memory-limit")
+    if memory_limit is not None and (rebuild_cache or engine == "pyarrow"):
+        # The export is streamed in chunks, never parsed whole or cached
+        raise click.UsageError(
+            "--memory-limit cannot be combined with --rebuild-cache or "
+            "--engine pyarrow"
         )
-        diff_mags = calculate_differential_magnitudes(
-            data, target_star, reference_stars
+    if ensemble == "weighted" and (incremental or memory_limit is not None):
+        # Reference means and clipping would depend on the sessions processed
+        raise click.UsageError(
+            "--ensemble weighted cannot be combined with --incremental or "
+            "--memory-limit"
         )
 
-        diff_data = pd.concat([diff_data, diff_mags], ignore_index=True)
+    from shutterbug.pipeline import find_data_files, process_files
+    from shutterbug.progress_bars import ProgressBarManager
 
-    logger.info("Differential magnitudes calculated successfully.")
+    try:
+        files = find_data_files(data_files)
+    except FileNotFoundError as e:
+        raise click.BadParameter(str(e), param_hint="'--data-file'")
 
-    # Split data by observation sessions
-    diff_data = split_by_session(diff_data)
-    # Plot light curves for each session
-    for session_id in diff_data["session"].unique():
+    progress = ProgressBarManager(enabled=not no_progress)
+    try:
+        summaries = process_files(
+            files,
+            output_dir=output_dir,
+            jobs=jobs,
+            results_file=results_file,
+            results_dir=results_dir,
+            engine=engine,
+            chunksize=chunk_size,
+            use_cache=not no_cache,
+            rebuild_cache=rebuild_cache,
+            references_file=references_file,
+            memory_limit=memory_limit,
+            incremental=incremental,
+            ensemble=ensemble,
+            clip_sigma=clip_sigma,
+            top_k=top_k,
+            min_score=min_score,
+            profile=profile,
+            profile_stats=profile_stats,
+            progress=progress,
+        )
+    finally:
+        progress.stop()
 
-        session_data = diff_data[diff_data["session"] == session_id]
-        logger.info(
-            f"Processing session {session_id} with {len(session_data)} observations."
+    # Per-file summary
+    click.echo()
+    for summary in summaries:
+        status = "ok" if summary.ok else f"FAILED ({summary.error})"
+        click.echo(
+            f"{summary.data_file}: {status}, {summary.measurements} measurements "
+            f"in {summary.seconds:.1f}s"
         )
+    failed = sum(not summary.ok for summary in summaries)
+    if failed:
+        click.echo(f"{failed} of {len(summaries)} files failed", err=True)
+        raise SystemExit(1)
 
-        # Plot light curves for each target star
-        for star in session_data["Name"].unique():
 
-            star_data = session_data[session_data["Name"] == star]
-            output_path = f"{star}_{session_id}_light_curve.png"
+@cli.command()
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    default=".",
+    show_default=True,
+    help="Directory for light curves, with a subdirectory for each export.",
+)
+@click.option(
+    "--results-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help=(
+        "Parquet dataset, partitioned by session and star, to keep up to date "
+        "with the differential magnitudes. Requires pyarrow."
+    ),
+)
+@click.option(
+    "--engine",
+    type=click.Choice(["c", "python", "pyarrow"]),
+    default="c",
+    show_default=True,
+    help="CSV parser engine. pyarrow must be installed separately.",
+)
+@REFERENCES_OPTION
+@TOP_K_OPTION
+@MIN_SCORE_OPTION
+@click.option(
+    "--max-stars",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Only measure this many of the brightest stars on the first FITS frame.",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of worker processes used to render light curves.",
+)
+@click.option(
+    "--debounce",
+    type=click.FloatRange(min=0),
+    default=2.0,
+    show_default=True,
+    help="Seconds a file must stay unchanged before it is read.",
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=1.0,
+    show_default=True,
+    help="Seconds between checks of the directory.",
+)
+def watch(
+    directory,
+    output_dir,
+    results_dir,
+    engine,
+    references_file,
+    top_k,
+    min_score,
+    max_stars,
+    jobs,
+    debounce,
+    interval,
+):
+    """Update light curves live as Mirax exports or FITS frames arrive in DIRECTORY.
 
-            logger.debug(f"Plotting light curve for star {star}")
-            plot_light_curve(star_data, star, output_path)
+    Runs until interrupted, keeping each export's data and reference stars in
+    memory so an update only reads the newly appended rows. New FITS frames
+    are reduced as by the reduce command, with stars detected on the first
+    frame, and their light curves go to a frames subdirectory. Reference
+    stars are combined with a plain mean, since the weighted ensemble
+    depends on the whole export.
+    """
+    from shutterbug.watch import ExportWatcher
+
+    watcher = ExportWatcher(
+        directory,
+        output_dir=output_dir,
+        results_dir=results_dir,
+        engine=engine,
+        references_file=references_file,
+        top_k=top_k,
+        min_score=min_score,
+        jobs=jobs,
+        debounce=debounce,
+        max_stars=max_stars,
+    )
+    watcher.run(interval=interval)
+
+
+@cli.command()
+@click.argument("results", type=click.Path(exists=True))
+@click.option(
+    "--host",
+    default="127.0.0.1",
+    show_default=True,
+    help="Address to listen on. Only this machine can connect by default.",
+)
+@click.option(
+    "--port",
+    type=click.IntRange(min=0, max=65535),
+    default=8765,
+    show_default=True,
+    help="Port to listen on.",
+)
+@click.option(
+    "--check-interval",
+    type=click.FloatRange(min=0),
+    default=2.0,
+    show_default=True,
+    help="Seconds between checks of RESULTS for changes.",
+)
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=0),
+    default=1024,
+    show_default=True,
+    help="Number of responses to keep cached.",
+)
+def serve(results, host, port, check_interval, cache_size):
+    """Answer light curve queries about RESULTS over HTTP.
+
+    RESULTS is a --results-file CSV or a --results-dir dataset. It is loaded
+    and indexed once, and reloaded when it changes. Responses are JSON, or
+    Arrow streams with format=arrow:
+
+    \b
+      /curve?star=NAME[&session=S][&jd_min=JD][&jd_max=JD]
+      /observations?[session=S][&jd_min=JD][&jd_max=JD]
+      /ranking?[session=S][&top_k=N][&min_score=X]
+      /sessions
+      /stars
+    """
+    from shutterbug.server import serve as serve_results
+
+    serve_results(
+        results,
+        host=host,
+        port=port,
+        check_interval=check_interval,
+        cache_size=cache_size,
+    )
+
+
+@cli.command()
+@click.argument("data_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("output", type=click.Path(dir_okay=False, writable=True))
+@click.option(
+    "--engine",
+    type=click.Choice(["c", "python", "pyarrow"]),
+    default="c",
+    show_default=True,
+    help="CSV parser engine. pyarrow must be installed separately.",
+)
+@click.option(
+    "--max-distance",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Use every star within this many pixels, and at least --min-refs.",
+)
+@click.option(
+    "--min-refs",
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help="Fewest reference stars per target when --max-distance is given.",
+)
+@click.option(
+    "--max-refs",
+    type=click.IntRange(min=1),
+    default=50,
+    show_default=True,
+    help="Number of nearest reference stars per target without --max-distance.",
+)
+def references(data_file, output, engine, max_distance, min_refs, max_refs):
+    """Save the reference stars selected for DATA_FILE to OUTPUT.
+
+    Pass OUTPUT to --references on later runs so that every night of a
+    campaign is compared with the same stars. The CSV has a row for each
+    target and reference star and may be edited.
+    """
+    from shutterbug.csv_loader import load_cached_mirax_export
+    from shutterbug.references import (
+        cached_reference_stars,
+        reference_cache_dir,
+        save_reference_sets,
+    )
+
+    _, metadata = load_cached_mirax_export(data_file, engine=engine)
+    reference_indices = cached_reference_stars(
+        metadata,
+        cache_dir=reference_cache_dir(),
+        max_distance=max_distance,
+        min_refs=min_refs,
+        max_refs=max_refs,
+    )
+    save_reference_sets(output, metadata, reference_indices)
+    click.echo(f"Saved reference stars for {len(metadata)} targets to {output}")
+
+
+@cli.command()
+@click.argument("frames", nargs=-1, required=True)
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    default=".",
+    show_default=True,
+    help="Directory for light curves and the variability ranking.",
+)
+@click.option(
+    "--reference-frame",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="Frame to detect stars on. Defaults to the first frame.",
+)
+@click.option(
+    "--max-stars",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Only measure this many of the brightest stars on the reference frame.",
+)
+@click.option(
+    "--threshold",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Detection threshold in background deviations. Defaults to the GUI's.",
+)
+@click.option(
+    "--fwhm",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Expected star FWHM in pixels. Defaults to the GUI's.",
+)
+@click.option(
+    "--match-radius",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Pixels a star may be from its expected position and still match.",
+)
+@click.option(
+    "--aperture",
+    "aperture_radius",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Aperture radius in pixels. Defaults to the GUI's.",
+)
+@click.option(
+    "--annulus-inner",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Inner background annulus radius in pixels. Defaults to the GUI's.",
+)
+@click.option(
+    "--annulus-outer",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Outer background annulus radius in pixels. Defaults to the GUI's.",
+)
+@click.option(
+    "--background",
+    type=click.Choice(["sigma_clip", "median", "mode"]),
+    default=None,
+    help=(
+        "Estimator of the sky level in each star's annulus. Defaults to the "
+        "sigma-clipped median."
+    ),
+)
+@click.option(
+    "--gain",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Detector gain in electrons per ADU.",
+)
+@click.option(
+    "--read-noise",
+    type=click.FloatRange(min=0),
+    default=None,
+    help="Detector read noise in electrons.",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of worker processes to reduce frames and render light curves.",
+)
+@click.option(
+    "--photometry-file",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="CSV file to save the measured magnitudes to, in the Mirax export format.",
+)
+@click.option(
+    "--results-file",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="CSV file to write the differential magnitudes to.",
+)
+@click.option(
+    "--results-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help=(
+        "Parquet dataset, partitioned by session and star, to add the "
+        "differential magnitudes to. Requires pyarrow."
+    ),
+)
+@ENSEMBLE_OPTION
+@CLIP_SIGMA_OPTION
+@TOP_K_OPTION
+@MIN_SCORE_OPTION
+@NO_PROGRESS_OPTION
+def reduce(
+    frames,
+    output_dir,
+    reference_frame,
+    max_stars,
+    jobs,
+    photometry_file,
+    results_file,
+    results_dir,
+    ensemble,
+    clip_sigma,
+    top_k,
+    min_score,
+    no_progress,
+    **photometry_options,
+):
+    """Reduce FITS FRAMES to differential light curves, without the GUI.
+
+    Detects stars on a reference frame, matches them on every frame and
+    measures them with aperture photometry, then produces the same results
+    as for a Mirax export. FRAMES may be files, glob patterns or directories.
+    """
+    from shutterbug.progress_bars import ProgressBarManager
+    from shutterbug.reduction import (
+        ReductionParameters,
+        find_frame_files,
+        reduce_frames,
+    )
+
+    try:
+        frame_files = find_frame_files(frames)
+    except FileNotFoundError as e:
+        raise click.BadParameter(str(e), param_hint="'FRAMES'")
+
+    params = ReductionParameters(
+        **{
+            name: value
+            for name, value in photometry_options.items()
+            if value is not None
+        }
+    )
+    progress = ProgressBarManager(enabled=not no_progress)
+    try:
+        diff_data = reduce_frames(
+            frame_files,
+            output_dir=output_dir,
+            params=params,
+            reference_frame=reference_frame,
+            max_stars=max_stars,
+            jobs=jobs,
+            photometry_file=photometry_file,
+            results_file=results_file,
+            results_dir=results_dir,
+            ensemble=ensemble,
+            clip_sigma=clip_sigma,
+            top_k=top_k,
+            min_score=min_score,
+            progress=progress,
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        progress.stop()
+    click.echo(
+        f"Reduced {len(frame_files)} frames to {len(diff_data)} differential "
+        f"magnitudes"
+    )
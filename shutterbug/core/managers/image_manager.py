@@ -12,10 +12,9 @@ import logging
 from typing import Dict, List
 
 import numpy as np
-from astropy import stats
-from photutils.detection import DAOStarFinder
 from PySide6.QtCore import QPoint, Slot
 from shutterbug.core.models import FITSModel
+from shutterbug.core.utility import detection
 
 from .base_manager import BaseManager
 
@@ -25,9 +24,9 @@ class ImageManager(BaseManager):
 
     # Star Finding defaults
     MAX_DISTANCE_DEFAULT = 10  # pixels
-    SIGMA_DEFAULT = 2.0
-    FWHM_DEFAULT = 3.0
-    THRESHOLD_DEFAULT = 3.0
+    SIGMA_DEFAULT = detection.SIGMA_DEFAULT
+    FWHM_DEFAULT = detection.FWHM_DEFAULT
+    THRESHOLD_DEFAULT = detection.THRESHOLD_DEFAULT
     MINIMUM_AREA_DEFAULT = 50  # pixel
     FLUX_TOLERANCE_DEFAULT = 10  # percent
 
@@ -116,18 +115,9 @@ class ImageManager(BaseManager):
 
         return None
 
-    def _compute_background(self, data, sigma: float = SIGMA_DEFAULT):
-        """Calculate background of image using sigma-clipped statistics"""
-
-        _, median, _ = stats.sigma_clipped_stats(data, sigma=sigma)
-
-        return median
-
     def get_background_subtracted(self, data, sigma: float = SIGMA_DEFAULT):
         """Get background-subtracted data, creates if unavailable"""
-        background = self._compute_background(data, sigma)
-        background_subtracted = data - background
-        return background_subtracted
+        return detection.background_subtracted(data, sigma)
 
     def find_centroids_from_points(
         self,
@@ -172,19 +162,7 @@ class ImageManager(BaseManager):
         fwhm: float = FWHM_DEFAULT,
     ):
         """Detect centroids using DAOStarFinder"""
-        bg_subtracted = self.get_background_subtracted(data, sigma)
-        if bg_subtracted is None:
-            return
-
-        # Estimate FWHM and threshold
-        _, _, std = stats.sigma_clipped_stats(bg_subtracted, sigma=sigma)
-
-        daofind = DAOStarFinder(
-            fwhm=fwhm, threshold=threshold * std, roundlo=-0.75, roundhi=0.75
-        )
-        centroids = daofind(bg_subtracted)
-
-        return centroids
+        return detection.find_centroids(data, threshold, sigma, fwhm)
 
     def compute_stats(self, image: FITSModel):
         """Computes the statistics of the image for display"""
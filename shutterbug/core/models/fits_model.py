@@ -70,6 +70,8 @@ class FITSModel(ObservableQObject):
 
         # Star variables, computed
         self.background: float | None = None
+        # SNR-optimal aperture radius, from curves of growth
+        self.optimal_radius: float | None = None
 
     def _scale_data(self, data):
         return self.bzero + data * self.bscale
@@ -83,6 +85,26 @@ class FITSModel(ObservableQObject):
         data = self._scale_data(data)
         return data
 
+    def get_cutout(self, x: float, y: float, half_size: int):
+        """Gets a square cutout of scaled data centred on a point
+
+        The cutout is 2 * half_size + 1 pixels wide, NaN beyond the edges
+        of the image. Returns the cutout and the point's position in it.
+        """
+        size = 2 * half_size + 1
+        x0 = floor(x) - half_size
+        y0 = floor(y) - half_size
+        cutout = np.full((size, size), np.nan)
+        height, width = self._data.shape
+        ys = slice(max(y0, 0), min(y0 + size, height))
+        xs = slice(max(x0, 0), min(x0 + size, width))
+        if ys.start < ys.stop and xs.start < xs.stop:
+            data = np.asarray(self._data[ys, xs], dtype=np.float64)
+            cutout[ys.start - y0 : ys.stop - y0, xs.start - x0 : xs.stop - x0] = (
+                self._scale_data(data)
+            )
+        return cutout, (x - x0, y - y0)
+
     def get_stamp_from_points(self, x0: int, x1: int, y0: int, y1: int):
         data = self._data[y0:y1, x0:x1]
         data = self._scale_data(data)
@@ -47,6 +47,8 @@ class MarkerModel(ObservableQObject):
         self.colour = self._define_field("colour", colour)
         self.thickness = self._define_field("thickness", thickness)
         self.visible = self._define_field("visible", visible)
+        # Text shown beside the marker
+        self.label = self._define_field("label", "")
 
     @property
     def rect(self):
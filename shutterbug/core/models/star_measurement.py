@@ -45,3 +45,6 @@ class StarMeasurement(ObservableQObject):
         self.mag_error = self._define_field("mag_error", mag_error)
         self.diff_mag = self._define_field("diff_mag", diff_mag)
         self.diff_err = self._define_field("diff_err", diff_err)
+        self.optimal_radius = self._define_field("optimal_radius", None)
+        # Radii, (4, radii) results and annulus of the last curve of growth
+        self.growth = None
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+from astropy import stats
+from photutils.detection import DAOStarFinder
+
+# Star finding defaults
+SIGMA_DEFAULT = 2.0
+FWHM_DEFAULT = 3.0
+THRESHOLD_DEFAULT = 3.0
+
+
+def background_subtracted(data, sigma: float = SIGMA_DEFAULT):
+    """Subtract the sigma-clipped median background from image data"""
+    _, median, _ = stats.sigma_clipped_stats(data, sigma=sigma)
+    return data - median
+
+
+def find_centroids(
+    data,
+    threshold: float = THRESHOLD_DEFAULT,
+    sigma: float = SIGMA_DEFAULT,
+    fwhm: float = FWHM_DEFAULT,
+):
+    """Detect centroids using DAOStarFinder
+
+    Returns a table with xcentroid, ycentroid, flux and mag columns, or None
+    if no stars were found.
+    """
+    bg_subtracted = background_subtracted(data, sigma)
+
+    # Estimate FWHM and threshold
+    _, _, std = stats.sigma_clipped_stats(bg_subtracted, sigma=sigma)
+
+    daofind = DAOStarFinder(
+        fwhm=fwhm, threshold=threshold * std, roundlo=-0.75, roundhi=0.75
+    )
+    return daofind(bg_subtracted)
@@ -1,7 +1,30 @@
+import hashlib
+import io
+import json
 import logging
+from itertools import islice
 import pandas as pd
 import numpy as np
 from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from pandas.api.types import union_categoricals
+
+# Columns read from a Mirax export, and the dtypes to parse them as
+OBSERVATION_COLUMNS = ["Name", "Mag", "JD", "Error"]
+SPATIAL_COLUMNS = ["Name", "X", "Y"]
+EXPORT_DTYPES = {
+    "Name": "category",
+    "Mag": np.float32,
+    "JD": np.float64,
+    "Error": np.float32,
+    "X": np.float64,
+    "Y": np.float64,
+}
+
+# Sidecar cache of cleaned exports, bump the version when the format changes
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".shutterbug-cache"
 
 
 def load_observation_data(file_path: Path) -> pd.DataFrame:
@@ -42,3 +65,456 @@ def load_spatial_metadata(file_path: Path) -> pd.DataFrame:
     df = df.drop_duplicates(subset=["Name"])
     df = df.dropna(subset=["Name", "X", "Y"])
     return df
+
+
+def load_mirax_export(
+    file_path: Path, engine: str = "c", chunksize: Optional[int] = None
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Load observation data and spatial metadata from a single CSV parse.
+
+    Returns the same frames as ``load_observation_data`` and
+    ``load_spatial_metadata``. ``engine`` is passed to ``pd.read_csv`` and may
+    be "pyarrow" if it is installed. With ``chunksize``, the file is read and
+    cleaned that many rows at a time to bound peak memory. ``.xlsx`` exports
+    are streamed with ``load_xlsx_export`` instead, ignoring ``engine``.
+    """
+    if Path(file_path).suffix.lower() == ".xlsx":
+        return load_xlsx_export(file_path, block_size=chunksize or 100_000)
+
+    logging.info(f"Loading Mirax export from {file_path}")
+    return _parse_csv_export(file_path, engine=engine, chunksize=chunksize)
+
+
+def load_appended_rows(
+    file_path: Path,
+    offset: int,
+    engine: str = "c",
+    chunksize: Optional[int] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame, int]:
+    """Load the rows of a CSV export that start at byte ``offset``.
+
+    Only complete lines are read, so a file that is still being written can
+    be followed. Returns the cleaned observations and spatial metadata of
+    the new rows, and the offset to continue from next time.
+    """
+    with open(file_path, "rb") as f:
+        header = f.readline()
+        f.seek(max(offset, len(header)))
+        new_bytes = f.read()
+    complete = new_bytes.rfind(b"\n") + 1
+    data, metadata = _parse_csv_export(
+        io.BytesIO(header + new_bytes[:complete]), engine=engine, chunksize=chunksize
+    )
+    return data, metadata, max(offset, len(header)) + complete
+
+
+def _parse_csv_export(
+    source, engine: str = "c", chunksize: Optional[int] = None
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Parse and clean a CSV export from a path or open file."""
+    usecols = list(dict.fromkeys(OBSERVATION_COLUMNS + SPATIAL_COLUMNS))
+    dtype_dict = {col: EXPORT_DTYPES[col] for col in usecols}
+
+    if chunksize is None:
+        chunks: Iterable[pd.DataFrame] = [
+            pd.read_csv(source, usecols=usecols, dtype=dtype_dict, engine=engine)  # type: ignore
+        ]
+    elif engine == "pyarrow":
+        raise ValueError("The pyarrow engine does not support chunked reading")
+    else:
+        chunks = pd.read_csv(
+            source,
+            usecols=usecols,
+            dtype=dtype_dict,  # type: ignore
+            engine=engine,  # type: ignore
+            chunksize=chunksize,
+        )
+
+    observations = []
+    spatial = []
+    for chunk in chunks:
+        observations.append(_clean_observation_chunk(chunk[OBSERVATION_COLUMNS]))
+        spatial.append(chunk[SPATIAL_COLUMNS].drop_duplicates(subset=["Name"]))
+
+    logging.info("Cleaning observation data")
+    data = concat_chunks(observations)
+    data = data.drop_duplicates(subset=["Name", "JD"])
+    data = data.sort_values(by=["Name"])
+
+    logging.debug("Cleaning spatial metadata")
+    metadata = concat_chunks(spatial).drop_duplicates(subset=["Name"])
+    metadata = metadata.dropna(subset=SPATIAL_COLUMNS)
+    metadata = metadata.astype({"Name": object})
+    return data, metadata
+
+
+def load_xlsx_export(
+    file_path: Path, sheet_name: Optional[str] = None, block_size: int = 100_000
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Stream a Mirax ``.xlsx`` export into the frames ``load_mirax_export`` returns.
+
+    The worksheet (the first one unless ``sheet_name`` is given) is read row
+    by row in openpyxl's read-only mode, ``block_size`` rows at a time, and
+    converted straight into typed columns: Name as category codes, Mag and
+    Error as float32 and JD as float64. Requires openpyxl.
+    """
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise ImportError("Reading .xlsx exports requires openpyxl") from e
+
+    usecols = list(dict.fromkeys(OBSERVATION_COLUMNS + SPATIAL_COLUMNS))
+    numeric = [col for col in usecols if col != "Name"]
+
+    logging.info(f"Loading Mirax export from {file_path}")
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = [
+            str(cell).strip() if cell is not None else "" for cell in next(rows, ())
+        ]
+        missing = [col for col in usecols if col not in header]
+        if missing:
+            raise ValueError(
+                f"Columns expected but not found in {file_path}: {missing}"
+            )
+        positions = {col: header.index(col) for col in usecols}
+
+        name_codes: dict = {}
+        code_blocks = []
+        value_blocks: dict = {col: [] for col in numeric}
+        while block := list(islice(rows, block_size)):
+            columns = list(zip(*block))
+            code_blocks.append(
+                np.fromiter(
+                    (
+                        (
+                            -1
+                            if name is None
+                            else name_codes.setdefault(str(name), len(name_codes))
+                        )
+                        for name in columns[positions["Name"]]
+                    ),
+                    dtype=np.int32,
+                    count=len(block),
+                )
+            )
+            for col in numeric:
+                value_blocks[col].append(
+                    _numeric_column(columns[positions[col]], EXPORT_DTYPES[col])
+                )
+    finally:
+        workbook.close()
+
+    # Sorted categories, matching the CSV loaders
+    categories = np.array(list(name_codes), dtype=object)
+    order = np.argsort(categories)
+    ranks = np.empty(len(order), dtype=np.int32)
+    ranks[order] = np.arange(len(order), dtype=np.int32)
+    codes = np.concatenate(code_blocks) if code_blocks else np.empty(0, np.int32)
+    codes = np.where(codes >= 0, ranks[np.maximum(codes, 0)], -1)
+    categories = categories[order]
+    names = pd.Categorical.from_codes(codes, categories=categories)
+    values = {
+        col: (
+            np.concatenate(value_blocks[col]).astype(EXPORT_DTYPES[col])
+            if value_blocks[col]
+            else np.empty(0, EXPORT_DTYPES[col])
+        )
+        for col in numeric
+    }
+
+    logging.info("Cleaning observation data")
+    data = pd.DataFrame(
+        {"Name": names, **{col: values[col] for col in OBSERVATION_COLUMNS[1:]}}
+    )
+    data = _clean_observation_chunk(data).sort_values(by=["Name"])
+
+    logging.debug("Cleaning spatial metadata")
+    # First row of each star, in file order
+    _, first = np.unique(codes, return_index=True)
+    first = np.sort(first[codes[first] >= 0])
+    metadata = pd.DataFrame(
+        {
+            "Name": categories[codes[first]],
+            "X": values["X"][first],
+            "Y": values["Y"][first],
+        }
+    )
+    metadata = metadata.dropna(subset=SPATIAL_COLUMNS)
+    return data, metadata
+
+
+def _numeric_column(cells: tuple, dtype) -> np.ndarray:
+    """Convert one block of worksheet cells to numbers, blanks and text as NaN."""
+    try:
+        return np.array(cells, dtype=dtype)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(cells), errors="coerce").to_numpy(dtype=dtype)
+
+
+# On-disk record layout for observations spilled by partition_mirax_export
+SPILL_DTYPE = np.dtype(
+    [("Name", np.int32), ("JD", np.float64), ("Mag", np.float32), ("Error", np.float32)]
+)
+
+
+def scan_mirax_export(
+    file_path: Path, chunksize: int = 1_000_000, engine: str = "c"
+) -> Tuple[pd.DataFrame, pd.Series]:
+    """Stream a Mirax export once for its spatial metadata and row count per JD.
+
+    Only one chunk of the file is held in memory at a time.
+    """
+    if engine == "pyarrow":
+        raise ValueError("The pyarrow engine does not support chunked reading")
+    usecols = list(dict.fromkeys(["JD"] + SPATIAL_COLUMNS))
+    dtype_dict = {col: EXPORT_DTYPES[col] for col in usecols}
+
+    logging.info(f"Scanning Mirax export {file_path}")
+    spatial = []
+    jd_counts = pd.Series(dtype=np.int64)
+    for chunk in pd.read_csv(
+        file_path,
+        usecols=usecols,
+        dtype=dtype_dict,  # type: ignore
+        engine=engine,  # type: ignore
+        chunksize=chunksize,
+    ):
+        spatial.append(chunk[SPATIAL_COLUMNS].drop_duplicates(subset=["Name"]))
+        jd_counts = jd_counts.add(chunk["JD"].value_counts(), fill_value=0)
+
+    metadata = concat_chunks(spatial).drop_duplicates(subset=["Name"])
+    metadata = metadata.dropna(subset=SPATIAL_COLUMNS)
+    metadata = metadata.astype({"Name": object})
+    return metadata, jd_counts.sort_index().astype(np.int64)
+
+
+def partition_mirax_export(
+    file_path: Path,
+    names: List[str],
+    window_starts: np.ndarray,
+    spill_dir: Path,
+    chunksize: int = 1_000_000,
+    engine: str = "c",
+) -> List[Path]:
+    """Stream a Mirax export into one spill file per JD window.
+
+    ``window_starts`` holds the sorted first JD of each window. Observations
+    of stars not in ``names`` are dropped, the rest are cleaned per chunk and
+    appended to ``spill_dir`` as ``SPILL_DTYPE`` records, in file order.
+    Returns the spill file of each window, read back with ``load_window``.
+    """
+    dtype_dict = {col: EXPORT_DTYPES[col] for col in OBSERVATION_COLUMNS}
+    paths = [Path(spill_dir) / f"window-{i}.bin" for i in range(len(window_starts))]
+    for path in paths:
+        path.write_bytes(b"")
+
+    logging.info(f"Partitioning {file_path} into {len(paths)} JD windows")
+    for chunk in pd.read_csv(
+        file_path,
+        usecols=OBSERVATION_COLUMNS,
+        dtype=dtype_dict,  # type: ignore
+        engine=engine,  # type: ignore
+        chunksize=chunksize,
+    ):
+        chunk = _clean_observation_chunk(chunk)
+        codes = pd.Categorical(chunk["Name"], categories=names).codes
+        known = codes >= 0
+        jd = chunk["JD"].to_numpy()[known]
+
+        records = np.empty(len(jd), dtype=SPILL_DTYPE)
+        records["Name"] = codes[known]
+        records["JD"] = jd
+        records["Mag"] = chunk["Mag"].to_numpy()[known]
+        records["Error"] = chunk["Error"].to_numpy()[known]
+
+        windows = np.searchsorted(window_starts, jd, side="right") - 1
+        order = np.argsort(windows, kind="stable")
+        bounds = np.searchsorted(windows[order], np.arange(len(paths) + 1))
+        for i, path in enumerate(paths):
+            if bounds[i] < bounds[i + 1]:
+                with open(path, "ab") as f:
+                    records[order[bounds[i] : bounds[i + 1]]].tofile(f)
+    return paths
+
+
+def load_window(path: Path, names: List[str]) -> pd.DataFrame:
+    """Load one spilled JD window as cleaned observation data."""
+    records = np.fromfile(path, dtype=SPILL_DTYPE)
+    df = pd.DataFrame(
+        {
+            "Name": pd.Categorical.from_codes(records["Name"], categories=names),
+            "Mag": records["Mag"],
+            "JD": records["JD"],
+            "Error": records["Error"],
+        }
+    )
+    df = df.drop_duplicates(subset=["Name", "JD"])
+    return df.sort_values(by=["Name"])
+
+
+def _clean_observation_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    """Apply the row-local steps of ``clean_data`` to one chunk."""
+    df = df.dropna(axis=0, subset=["Mag", "JD"])
+    return df.drop_duplicates(subset=["Name", "JD"])
+
+
+def concat_chunks(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate chunks, keeping Name categorical across differing categories."""
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+    names = union_categoricals([c["Name"] for c in chunks], sort_categories=True)
+    df = pd.concat([c.drop(columns="Name") for c in chunks], ignore_index=True)
+    df.insert(0, "Name", names)
+    return df
+
+
+def load_cached_mirax_export(
+    file_path: Path,
+    engine: str = "c",
+    chunksize: Optional[int] = None,
+    rebuild: bool = False,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Load a Mirax export through a columnar sidecar cache.
+
+    Cleaned frames are stored as Feather files in a directory next to the
+    source file, keyed by its size, modification time and content hash.
+    Matching caches are memory-mapped instead of parsing the CSV again. When
+    rows have only been appended to a CSV since it was cached, just the new
+    rows are parsed and merged into the cache. Requires pyarrow, without it
+    this falls back to ``load_mirax_export``.
+    """
+    file_path = Path(file_path)
+    try:
+        from pyarrow import feather
+    except ImportError:
+        logging.warning("pyarrow is not installed, not caching parsed exports")
+        return load_mirax_export(file_path, engine=engine, chunksize=chunksize)
+
+    cache_dir = file_path.with_name(file_path.name + CACHE_SUFFIX)
+    manifest_path = cache_dir / "manifest.json"
+    observations_path = cache_dir / "observations.feather"
+    spatial_path = cache_dir / "spatial.feather"
+
+    if not rebuild and _cache_is_valid(file_path, manifest_path):
+        logging.info(f"Loading cached Mirax export from {cache_dir}")
+        data = feather.read_table(observations_path, memory_map=True).to_pandas()
+        metadata = feather.read_table(spatial_path, memory_map=True).to_pandas()
+        return data, metadata
+
+    appended = None if rebuild else _appended_offset(file_path, manifest_path)
+    if appended is not None:
+        logging.info(f"Parsing rows appended to {file_path} since it was cached")
+        # Not memory-mapped, as the cache files are rewritten below
+        cached = feather.read_table(observations_path).to_pandas()
+        cached_spatial = feather.read_table(spatial_path).to_pandas()
+        new_data, new_metadata, _ = load_appended_rows(
+            file_path, appended, engine=engine, chunksize=chunksize
+        )
+        data = concat_chunks([cached, new_data])
+        data = data.drop_duplicates(subset=["Name", "JD"])
+        data = data.sort_values(by=["Name"])
+        metadata = pd.concat([cached_spatial, new_metadata], ignore_index=True)
+        metadata = metadata.drop_duplicates(subset=["Name"])
+    else:
+        data, metadata = load_mirax_export(
+            file_path, engine=engine, chunksize=chunksize
+        )
+    try:
+        cache_dir.mkdir(exist_ok=True)
+        # Invalidate first, so an interrupted write is never read back
+        manifest_path.unlink(missing_ok=True)
+        # Uncompressed, so the columns can be memory-mapped on read
+        for frame, path in ((data, observations_path), (metadata, spatial_path)):
+            feather.write_feather(
+                frame.reset_index(drop=True), path, compression="uncompressed"
+            )
+        manifest_path.write_text(json.dumps(_file_fingerprint(file_path)))
+        logging.info(f"Cached parsed Mirax export in {cache_dir}")
+    except OSError as e:
+        logging.warning(f"Unable to write cache {cache_dir}: {e}")
+    return data, metadata
+
+
+def _cache_is_valid(file_path: Path, manifest_path: Path) -> bool:
+    """Check whether a cache manifest still describes the source file."""
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (OSError, ValueError):
+        return False
+    if manifest.get("version") != CACHE_VERSION:
+        return False
+
+    stat = file_path.stat()
+    if manifest.get("size") != stat.st_size:
+        return False
+    if manifest.get("mtime_ns") == stat.st_mtime_ns:
+        return True
+
+    # Touched or copied, only trust the cache if the content is unchanged
+    if manifest.get("sha256") != _file_hash(file_path):
+        return False
+    manifest["mtime_ns"] = stat.st_mtime_ns
+    try:
+        manifest_path.write_text(json.dumps(manifest))
+    except OSError:
+        pass
+    return True
+
+
+def _appended_offset(file_path: Path, manifest_path: Path) -> Optional[int]:
+    """Size of the cached file, if the CSV has since only had rows appended."""
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (OSError, ValueError):
+        return None
+    size = manifest.get("size")
+    if (
+        manifest.get("version") != CACHE_VERSION
+        or file_path.suffix.lower() != ".csv"
+        or not isinstance(size, int)
+        or not 0 < size < file_path.stat().st_size
+    ):
+        return None
+    # Both parts must end on a whole row, and the cached part be unchanged
+    with open(file_path, "rb") as f:
+        f.seek(size - 1)
+        if f.read(1) != b"\n":
+            return None
+        f.seek(-1, io.SEEK_END)
+        if f.read(1) != b"\n":
+            return None
+    if manifest.get("sha256") != _file_hash(file_path, length=size):
+        return None
+    return size
+
+
+def _file_fingerprint(file_path: Path) -> dict:
+    """Size, modification time and content hash identifying a source file."""
+    stat = file_path.stat()
+    return {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": _file_hash(file_path),
+    }
+
+
+def _file_hash(
+    file_path: Path, block_size: int = 1 << 23, length: Optional[int] = None
+) -> str:
+    """SHA-256 of a file's contents, or its first ``length`` bytes, in blocks."""
+    digest = hashlib.sha256()
+    remaining = length
+    with open(file_path, "rb") as f:
+        while remaining is None or remaining > 0:
+            size = block_size if remaining is None else min(block_size, remaining)
+            block = f.read(size)
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest.hexdigest()
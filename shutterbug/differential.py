@@ -1,9 +1,13 @@
-from typing import List
+import hashlib
+from typing import List, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
 import logging
 
+from scipy import sparse
+from scipy.spatial import cKDTree
+
 
 def calculate_differential_magnitudes(
     data: pd.DataFrame, target_star: str, reference_stars: List[str]
@@ -58,8 +62,10 @@ def find_reference_stars(
     target_pos = data[data["Name"] == target_star][["X", "Y"]].iloc[0]
 
     # Calculate distances to all other stars
-    data["distance"] = np.sqrt(
-        (data["X"] - target_pos.X) ** 2 + (data["Y"] - target_pos.Y) ** 2
+    data = data.assign(
+        distance=np.sqrt(
+            (data["X"] - target_pos.X) ** 2 + (data["Y"] - target_pos.Y) ** 2
+        )
     )
 
     # Sort by distance, excluding the target star itself
@@ -79,3 +85,298 @@ def find_reference_stars(
     )
     logging.info(f"Reference stars: {candidates['Name'].tolist()}")
     return candidates["Name"].tolist()
+
+
+def find_all_reference_stars(
+    data: pd.DataFrame,
+    max_distance: float | None = None,
+    min_refs: int = 10,
+    max_refs: int = 50,
+) -> np.ndarray:
+    """Finds reference stars for every star in the spatial metadata at once.
+
+    Uses the same selection rules as ``find_reference_stars``, answered with
+    a single KD-tree query. Row ``i`` of the returned array holds the
+    positional indices into ``data`` of the references for star ``i``,
+    nearest first, padded with -1.
+    """
+    positions = data[["X", "Y"]].to_numpy(dtype=np.float64)
+    n_stars = len(positions)
+    tree = cKDTree(positions)
+
+    if max_distance:
+        # Everything within range, and at least the closest min_refs
+        in_range = tree.query_ball_point(positions, r=max_distance, return_length=True)
+        k = max(int(np.max(in_range, initial=0)) - 1, min_refs)
+    else:
+        k = max_refs
+    k = min(k, n_stars - 1)
+    if k <= 0:
+        return np.full((n_stars, 0), -1, dtype=np.intp)
+
+    # One extra neighbour, since every star finds itself
+    distances, indices = tree.query(positions, k=k + 1)
+    keep = (indices != np.arange(n_stars)[:, None]) & (indices < n_stars)
+    if max_distance:
+        keep[:, min_refs + 1 :] &= distances[:, min_refs + 1 :] <= max_distance
+
+    # Compact kept neighbours to the left, preserving distance order
+    order = np.argsort(~keep, axis=1, kind="stable")[:, :k]
+    indices = np.take_along_axis(indices, order, axis=1)
+    keep = np.take_along_axis(keep, order, axis=1)
+    reference_indices = np.where(keep, indices, -1).astype(np.intp)
+
+    counts = keep.sum(axis=1)
+    low, high = counts.min(), counts.max()
+    found = f"{low}" if low == high else f"{low}-{high}"
+    logging.info(f"Found {found} reference stars for each of {n_stars} target stars")
+    return reference_indices
+
+
+def pivot_observations(
+    data: pd.DataFrame, names: Sequence[str]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pivots observations into JD x star magnitude and error matrices.
+
+    Columns follow the order of ``names``, missing observations are NaN and
+    observations of stars not in ``names`` are dropped.
+    """
+    star_codes = pd.Categorical(data["Name"], categories=names).codes
+    known = star_codes >= 0
+    star_codes = star_codes[known]
+    jd, jd_codes = np.unique(data["JD"].to_numpy()[known], return_inverse=True)
+
+    shape = (len(jd), len(names))
+    mags = np.full(shape, np.nan)
+    errors = np.full(shape, np.nan)
+    mags[jd_codes, star_codes] = data["Mag"].to_numpy()[known]
+    errors[jd_codes, star_codes] = data["Error"].to_numpy()[known]
+    return jd, mags, errors
+
+
+def reference_index_array(
+    names: Sequence[str], reference_stars: Sequence[List[str]]
+) -> np.ndarray:
+    """Converts per-target reference name lists into a padded index array.
+
+    Row ``i`` holds the positions in ``names`` of the references for target
+    ``names[i]``, padded with -1.
+    """
+    positions = {name: i for i, name in enumerate(names)}
+    width = max((len(refs) for refs in reference_stars), default=0)
+    indices = np.full((len(reference_stars), width), -1, dtype=np.intp)
+    for row, refs in enumerate(reference_stars):
+        indices[row, : len(refs)] = [positions[ref] for ref in refs]
+    return indices
+
+
+def reference_set_ids(
+    names: Sequence[str], reference_indices: np.ndarray
+) -> np.ndarray:
+    """Short identifier of each target's reference star set.
+
+    Targets whose references are the same set of stars share an identifier,
+    across runs and regardless of reference order.
+    """
+    names = list(names)
+    ids = []
+    for row in reference_indices:
+        refs = sorted(names[i] for i in row if i >= 0)
+        ids.append(hashlib.sha1("\n".join(refs).encode()).hexdigest()[:12])
+    return np.asarray(ids)
+
+
+def calculate_all_differential_magnitudes(
+    data: pd.DataFrame, names: Sequence[str], reference_indices: np.ndarray
+) -> pd.DataFrame:
+    """Calculates differential magnitudes for every target star at once.
+
+    Each star in ``names`` is a target, and row ``i`` of ``reference_indices``
+    lists its reference stars as positions in ``names`` (-1 for padding).
+    Matches ``calculate_differential_magnitudes`` per target: at each JD the
+    differential magnitude is the mean of target minus each observed
+    reference, and the error is sqrt(sum(err_t**2 + err_ref**2)) / n.
+    """
+    names = list(names)
+    jd, mags, errors = pivot_observations(data, names)
+    membership = _reference_membership(reference_indices, len(names))
+
+    observed = ~np.isnan(mags)
+    ref_count = observed.astype(np.float64) @ membership
+    ref_mag_sum = np.where(observed, mags, 0.0) @ membership
+    ref_var_sum = np.where(observed, errors**2, 0.0) @ membership
+
+    valid = observed & (ref_count > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        diff_mags = mags - ref_mag_sum / ref_count
+        diff_errors = np.sqrt(ref_count * errors**2 + ref_var_sum) / ref_count
+
+    result = _tidy_results(jd, names, valid, diff_mags, diff_errors)
+    logging.info(
+        f"Calculated {len(result)} differential magnitudes for "
+        f"{result['Name'].nunique()} target stars over {len(jd)} epochs"
+    )
+    return result
+
+
+def calculate_weighted_differential_magnitudes(
+    data: pd.DataFrame,
+    names: Sequence[str],
+    reference_indices: np.ndarray,
+    clip_sigma: float = 3.0,
+    max_iterations: int = 5,
+) -> pd.DataFrame:
+    """Calculates inverse-variance weighted differential magnitudes.
+
+    Takes the same arguments as ``calculate_all_differential_magnitudes``.
+    Each target's ensemble magnitude is the inverse-variance weighted mean
+    of its observed references, and the error combines the target's error
+    with the ensemble's, sqrt(err_t**2 + 1 / sum(1 / err_ref**2)).
+
+    References are then iteratively clipped: every star's own differential
+    light curve is compared to the scatter its errors predict, and stars
+    more than ``clip_sigma`` robust deviations above the median ratio are
+    dropped from all ensembles, until none are clipped or
+    ``max_iterations`` is reached.
+
+    Observations with a missing or non-positive error carry no weight, but
+    are still measured as targets. Where none of a target's observed
+    references has a usable error, its ensemble falls back to their
+    unweighted mean.
+    """
+    names = list(names)
+    jd, mags, errors = pivot_observations(data, names)
+    membership = _reference_membership(reference_indices, len(names))
+
+    # Observations without a usable error cannot be weighted
+    observed = ~np.isnan(mags)
+    weighted = observed & (errors > 0)
+    weights = np.divide(1.0, errors**2, out=np.zeros_like(errors), where=weighted)
+
+    # References enter the ensemble relative to their own mean magnitude, so
+    # the ensemble does not jump when a bright or faint reference is missing
+    with np.errstate(invalid="ignore", divide="ignore"):
+        star_means = (weights * np.where(weighted, mags, 0.0)).sum(axis=0)
+        star_means /= weights.sum(axis=0)
+        # Unweighted for stars without any usable error
+        star_means = np.where(
+            weights.sum(axis=0) > 0,
+            star_means,
+            np.where(observed, mags, 0.0).sum(axis=0) / observed.sum(axis=0),
+        )
+    has_mean = np.isfinite(star_means)
+    offsets = np.where(observed, mags - star_means, 0.0)
+    weighted_offsets = offsets * weights
+    variances = np.where(observed, errors**2, 0.0)
+
+    active = np.ones(len(names), dtype=bool)
+    for iteration in range(max_iterations + 1):
+        ensemble = sparse.csc_array(membership * (active & has_mean)[:, None])
+        weight_sum = weights @ ensemble
+        ref_count = observed.astype(np.float64) @ ensemble
+        valid = observed & (ref_count > 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # Mean level of each target's ensemble, added back after normalising
+            levels = (ensemble.T @ np.where(has_mean, star_means, 0.0)) / (
+                ensemble.T @ has_mean.astype(np.float64)
+            )
+            ensemble_offsets = np.where(
+                weight_sum > 0,
+                (weighted_offsets @ ensemble) / weight_sum,
+                (offsets @ ensemble) / ref_count,
+            )
+            ensemble_vars = np.where(
+                weight_sum > 0, 1.0 / weight_sum, (variances @ ensemble) / ref_count**2
+            )
+            diff_mags = mags - ensemble_offsets - levels
+            diff_vars = errors**2 + ensemble_vars
+
+        if iteration == max_iterations:
+            break
+        # Only epochs with a usable expected scatter count towards clipping
+        scored = valid & np.isfinite(diff_vars) & (diff_vars > 0)
+        clipped = active & _excess_scatter(
+            diff_mags, diff_vars, scored, active, clip_sigma
+        )
+        if not clipped.any():
+            break
+        logging.debug(
+            f"Clipping {clipped.sum()} reference stars, iteration {iteration}"
+        )
+        active &= ~clipped
+
+    result = _tidy_results(jd, names, valid, diff_mags, np.sqrt(diff_vars))
+    logging.info(
+        f"Calculated {len(result)} weighted differential magnitudes for "
+        f"{result['Name'].nunique()} target stars over {len(jd)} epochs, "
+        f"{(~active).sum()} reference stars clipped"
+    )
+    return result
+
+
+def _excess_scatter(
+    diff_mags: np.ndarray,
+    diff_vars: np.ndarray,
+    valid: np.ndarray,
+    active: np.ndarray,
+    clip_sigma: float,
+) -> np.ndarray:
+    """Flags stars whose differential scatter is too high for their errors.
+
+    The statistic is each star's weighted RMS about its weighted mean,
+    divided by its median expected error. Stars are flagged when it lies
+    more than ``clip_sigma`` scaled MADs above the median of active stars.
+    """
+    mask = ~valid
+    diffs = np.ma.masked_array(diff_mags, mask)
+    weights = np.ma.masked_array(1.0 / np.where(valid, diff_vars, 1.0), mask)
+
+    mean = np.ma.average(diffs, axis=0, weights=weights)
+    rms = np.ma.sqrt(np.ma.average((diffs - mean) ** 2, axis=0, weights=weights))
+    expected = np.ma.median(np.ma.sqrt(np.ma.masked_array(diff_vars, mask)), axis=0)
+    ratio = np.ma.filled(rms / expected, np.nan)
+
+    # Only stars with at least two epochs have a meaningful scatter
+    usable = active & (valid.sum(axis=0) > 1) & np.isfinite(ratio)
+    if not usable.any():
+        return np.zeros_like(active)
+    median = np.median(ratio[usable])
+    mad = 1.4826 * np.median(np.abs(ratio[usable] - median))
+    if mad == 0:
+        return np.zeros_like(active)
+    return usable & (ratio > median + clip_sigma * mad)
+
+
+def _reference_membership(
+    reference_indices: np.ndarray, n_stars: int
+) -> sparse.csc_array:
+    """Sparse star x target matrix marking each target's reference stars.
+
+    Per-target sums over the reference ensemble become a single matrix
+    product with this matrix.
+    """
+    targets, slots = np.nonzero(reference_indices >= 0)
+    return sparse.csc_array(
+        (np.ones(len(targets)), (reference_indices[targets, slots], targets)),
+        shape=(n_stars, n_stars),
+    )
+
+
+def _tidy_results(
+    jd: np.ndarray,
+    names: List[str],
+    valid: np.ndarray,
+    diff_mags: np.ndarray,
+    diff_errors: np.ndarray,
+) -> pd.DataFrame:
+    """Collects valid cells of JD x star result matrices into a tidy frame."""
+    # Transposed so rows come out grouped by target, then sorted by JD
+    target_idx, jd_idx = np.nonzero(valid.T)
+    return pd.DataFrame(
+        {
+            "Name": pd.Categorical.from_codes(target_idx, categories=names),
+            "JD": jd[jd_idx],
+            "differential_magnitude": diff_mags[jd_idx, target_idx],
+            "differential_error": diff_errors[jd_idx, target_idx],
+        }
+    )
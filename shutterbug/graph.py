@@ -1,41 +1,129 @@
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
 
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import numpy as np
 import pandas as pd
 
-from astropy.time import Time
+from shutterbug.progress_bars import ProgressBarManager
+
+# matplotlib and astropy are slow to import, so they are only imported by
+# the functions that plot or convert times
 
 
 def plot_light_curve(df: pd.DataFrame, star_name: str, output_path: str):
     """Plot differential magnitude vs time."""
     # Convert JD to a more readable format
     logging.debug(f"Converting JD to readable time format for star {star_name}")
-    times = Time(df["JD"], format="jd").to_datetime().tolist()
+    times = jd_to_datetime64(df["JD"])
+    errors = df["differential_error"] if "differential_error" in df.columns else None
+    render_light_curve(
+        times, df["differential_magnitude"], errors, star_name, output_path
+    )
+    logging.debug(f"Light curve for {star_name} saved to {output_path}")
+
+
+def render_light_curve(
+    times: np.ndarray,
+    magnitudes: np.ndarray,
+    errors: Optional[np.ndarray],
+    star_name: str,
+    output_path: str,
+) -> str:
+    """Render a light curve to a PNG on its own Agg figure.
+
+    Does not touch pyplot's global state, so it is safe to call from worker
+    processes.
+    """
+    import matplotlib.dates as mdates
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+
     # Scatter plot with error bars if you have them
-    if "differential_error" in df.columns:
-        plt.errorbar(
-            times,
-            df["differential_magnitude"],
-            yerr=df["differential_error"],
-            fmt="o",
-            markersize=3,
-            alpha=0.6,
-        )
+    if errors is not None:
+        ax.errorbar(times, magnitudes, yerr=errors, fmt="o", markersize=3, alpha=0.6)
     else:
-        plt.scatter(times, df["differential_magnitude"], s=10, alpha=0.6)
+        ax.scatter(times, magnitudes, s=10, alpha=0.6)
 
     # Plot formatting
-    plt.tick_params(axis="x", labelrotation=45)
-    plt.xlabel("Time")
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
-    plt.ylabel("Differential Magnitude")
-    plt.title(f"Light Curve: {star_name}")
-    plt.gca().invert_yaxis()  # Magnitudes decrease upward
-    plt.grid(True, alpha=0.3)
-    plt.tight_layout()
-
-    # Save and close the plot
-    plt.savefig(output_path, dpi=150)
-    plt.close()
-    logging.info(f"Light curve for {star_name} saved to {output_path}")
+    ax.tick_params(axis="x", labelrotation=45)
+    ax.set_xlabel("Time")
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
+    ax.set_ylabel("Differential Magnitude")
+    ax.set_title(f"Light Curve: {star_name}")
+    ax.invert_yaxis()  # Magnitudes decrease upward
+    ax.grid(True, alpha=0.3)
+    figure.tight_layout()
+
+    figure.savefig(output_path, dpi=150)
+    return output_path
+
+
+def render_light_curves(
+    df: pd.DataFrame,
+    output_dir: Path = Path("."),
+    jobs: int = 1,
+    progress: Optional[ProgressBarManager] = None,
+) -> int:
+    """Render a light curve PNG for every star in every session.
+
+    Results are partitioned once by session and star, and JD is converted to
+    datetimes once per session. With ``jobs`` above one the PNGs are
+    rendered in a process pool. Returns the number of light curves written.
+    """
+    progress = progress or ProgressBarManager(enabled=False)
+    output_dir = Path(output_dir)
+    jd = df["JD"].to_numpy()
+    magnitudes = df["differential_magnitude"].to_numpy()
+    errors = df["differential_error"].to_numpy()
+
+    times = np.empty(len(df), dtype="datetime64[us]")
+    for session_id, rows in df.groupby("session").indices.items():
+        logging.debug(f"Processing session {session_id} with {len(rows)} observations.")
+        times[rows] = jd_to_datetime64(jd[rows])
+
+    tasks = [
+        (
+            times[rows],
+            magnitudes[rows],
+            errors[rows],
+            star,
+            str(output_dir / f"{star}_{session_id}_light_curve.png"),
+        )
+        for (session_id, star), rows in df.groupby(
+            ["session", "Name"], observed=True
+        ).indices.items()
+    ]
+
+    with progress.new("Light curves", "curves", len(tasks), stage="Plotting") as bar:
+        if jobs > 1 and len(tasks) > 1:
+            chunksize = max(1, len(tasks) // (jobs * 4))
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                for _ in executor.map(_render_task, tasks, chunksize=chunksize):
+                    bar.update()
+        else:
+            for task in tasks:
+                _render_task(task)
+                bar.update()
+
+    logging.info(f"Saved {len(tasks)} light curves to {output_dir}")
+    return len(tasks)
+
+
+def jd_to_datetime64(jd) -> np.ndarray:
+    """Convert Julian dates to UTC datetime64 values."""
+    from astropy.time import Time
+
+    return Time(jd, format="jd").datetime64
+
+
+def _render_task(task: tuple) -> str:
+    """Unpack a light curve task for ``render_light_curve``."""
+    output_path = render_light_curve(*task)
+    logging.debug(f"Light curve for {task[3]} saved to {output_path}")
+    return output_path
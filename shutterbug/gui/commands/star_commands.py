@@ -8,7 +8,10 @@ if TYPE_CHECKING:
     from shutterbug.core.app_controller import AppController
 
 import logging
+import threading
 from typing import List
+import numpy as np
+from PySide6.QtCore import QEventLoop, QObject, Signal, Slot
 from shutterbug.core.models import FITSModel, StarMeasurement
 from .base_command import BaseCommand
 import shutterbug.core.utility.photometry as phot
@@ -87,40 +90,115 @@ class PhotometryMeasurementCommand(BaseCommand):
                 "flux_error": m.flux_error,
                 "mag": m.mag,
                 "mag_error": m.mag_error,
+                "optimal_radius": m.optimal_radius,
+                "growth": m.growth,
             }
+        self.old_optimal_radius = image.optimal_radius
 
     def validate(self):
         if not self.measurements:
             raise ValueError("Unable to run photometry, no stars detected")
 
     def redo(self):
+        """Measures every star on the image in one batch
+
+        In either radii mode, if the stars already have curves of growth
+        with the current annulus that include the aperture radius, their
+        results are looked up from the stored curves instead of measured.
+        """
         logging.debug(
             f"COMMAND: Performing aperture photometry on {len(self.measurements)} stars"
         )
-        prog = self.controller.progress(
-            "Conducting photometry...", len(self.measurements)
-        )
+        if self.lookup():
+            return
+        # Every star is measured in one batch, so there is a single step
+        prog = self.controller.progress("Conducting photometry...", 1)
         with prog:
-            for m in self.measurements:
-                data = self.image.get_stamp(
-                    m.x, m.y, r=self.parameters.annulus_outer_radius
+            positions = np.array([(m.x, m.y) for m in self.measurements])
+            if self.parameters.radii == "curve of growth":
+                radii = self.growth_radii()
+                curves = phot.measure_curves_of_growth(
+                    positions,
+                    self.image.data,
+                    radii,
+                    annulus_inner=self.parameters.annulus_inner_radius,
+                    annulus_outer=self.parameters.annulus_outer_radius,
                 )
-                # star is in middle of data
-                x = data.shape[0] / 2
-                y = x
-                mag, mag_err, flux, flux_err = phot.measure_star_magnitude(
-                    x=x,
-                    y=y,
-                    data=data,
+                self.apply_curves(radii, curves)
+            else:
+                results = phot.measure_star_magnitudes(
+                    positions,
+                    self.image.data,
                     aperture_radius=self.parameters.aperture_radius,
                     annulus_inner=self.parameters.annulus_inner_radius,
                     annulus_outer=self.parameters.annulus_outer_radius,
                 )
-                m.mag = mag
-                m.mag_error = mag_err
-                m.flux = flux
-                m.flux_error = flux_err
-                prog.advance()
+                self.apply(*results)
+            prog.advance()
+
+    def growth_radii(self):
+        """Aperture radii measured for curves of growth"""
+        return phot.growth_radii(
+            self.parameters.annulus_inner_radius,
+            self.parameters.growth_step,
+            self.parameters.aperture_radius,
+        )
+
+    def lookup(self) -> bool:
+        """Takes the aperture radius' results from stored curves of growth
+
+        Returns False without changing anything unless every measurement
+        has a curve of growth, with the current annulus, that includes the
+        aperture radius.
+        """
+        annulus = (
+            self.parameters.annulus_inner_radius,
+            self.parameters.annulus_outer_radius,
+        )
+        results = []
+        for m in self.measurements:
+            if m.growth is None:
+                return False
+            radii, curve, growth_annulus = m.growth
+            matches = np.flatnonzero(np.isclose(radii, self.parameters.aperture_radius))
+            if growth_annulus != annulus or not len(matches):
+                return False
+            results.append(curve[:, matches[0]])
+        logging.debug(f"Using stored curves of growth for {self.image.filename}")
+        self.apply(*np.array(results).T)
+        return True
+
+    def apply_curves(self, radii, curves):
+        """Stores batched curves of growth on the measurements, in order, and
+        uses the results at the aperture radius"""
+        mags, mag_errors, fluxes, flux_errors = curves
+        per_star, self.image.optimal_radius = phot.optimal_radii(
+            radii, fluxes, flux_errors
+        )
+        logging.info(
+            f"SNR-optimal aperture radius on {self.image.filename}: "
+            f"{self.image.optimal_radius:.1f} pixels"
+        )
+        annulus = (
+            self.parameters.annulus_inner_radius,
+            self.parameters.annulus_outer_radius,
+        )
+        # One (4, radii) curve per star
+        stacked = np.stack([mags, mag_errors, fluxes, flux_errors], axis=1)
+        for m, curve, radius in zip(self.measurements, stacked, per_star):
+            m.growth = (radii, curve, annulus)
+            m.optimal_radius = None if np.isnan(radius) else float(radius)
+        self.lookup()
+
+    def apply(self, mags, mag_errors, fluxes, flux_errors):
+        """Assigns batched photometry results to the measurements, in order"""
+        for m, mag, mag_err, flux, flux_err in zip(
+            self.measurements, mags, mag_errors, fluxes, flux_errors
+        ):
+            m.mag = float(mag)
+            m.mag_error = float(mag_err)
+            m.flux = float(flux)
+            m.flux_error = float(flux_err)
 
     def undo(self):
         logging.debug(f"COMMAND: Undoing photometry on {len(self.measurements)} stars")
@@ -130,6 +208,9 @@ class PhotometryMeasurementCommand(BaseCommand):
             m.flux_error = o["flux_error"]
             m.mag = o["mag"]
             m.mag_error = o["mag_error"]
+            m.optimal_radius = o["optimal_radius"]
+            m.growth = o["growth"]
+        self.image.optimal_radius = self.old_optimal_radius
 
 
 class PhotometryAllCommand(BaseCommand):
@@ -154,11 +235,81 @@ class PhotometryAllCommand(BaseCommand):
             cmd.validate()
 
     def redo(self):
+        """Measures every image, reusing stored curves of growth
+
+        As for a single image, images whose stars have curves of growth
+        covering the aperture radius take their results from them, also
+        when measuring a single radius.
+        """
         logging.debug(
             f"COMMAND: Performing photometry on all measurements in all images"
         )
+        cmds = []
         for cmd in self.cmds:
-            cmd.redo()
+            # Applies the stored results when every star has them
+            if not cmd.lookup():
+                cmds.append(cmd)
+        if self.params.execution == "parallel" and len(cmds) > 1:
+            self._redo_parallel(cmds)
+        else:
+            for cmd in cmds:
+                cmd.redo()
+
+    def _redo_parallel(self, cmds: List[PhotometryMeasurementCommand]):
+        """Measures images on worker processes
+
+        Workers read the images from their memory-mapped FITS files. The pool
+        is driven from a background thread while this thread keeps painting
+        and updating progress, without taking user input, and the results
+        are applied here once every image is measured.
+        """
+        options = {
+            "annulus_inner": self.params.annulus_inner_radius,
+            "annulus_outer": self.params.annulus_outer_radius,
+        }
+        radii = None
+        if self.params.radii == "curve of growth":
+            radii = cmds[0].growth_radii()
+            options["radii"] = radii
+        else:
+            options["aperture_radius"] = self.params.aperture_radius
+
+        frames = (
+            [cmd.image.filepath for cmd in cmds],
+            [np.array([(m.x, m.y) for m in cmd.measurements]) for cmd in cmds],
+            [cmd.image.bzero for cmd in cmds],
+            [cmd.image.bscale for cmd in cmds],
+        )
+        prog = self.controller.progress("Conducting photometry...", len(cmds))
+        with prog:
+            loop = QEventLoop()
+            relay = _ProgressRelay(prog, loop)
+            results = []
+            errors = []
+
+            def measure():
+                try:
+                    for result in phot.measure_frames(
+                        *frames, self.params.jobs, **options
+                    ):
+                        results.append(result)
+                        relay.advanced.emit()
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    relay.done.emit()
+
+            worker = threading.Thread(target=measure, name="photometry-all")
+            worker.start()
+            loop.exec(QEventLoop.ProcessEventsFlag.ExcludeUserInputEvents)
+            worker.join()
+            if errors:
+                raise errors[0]
+            for cmd, result in zip(cmds, results):
+                if radii is None:
+                    cmd.apply(*result)
+                else:
+                    cmd.apply_curves(radii, result)
 
     def undo(self):
         logging.debug(f"COMMAND: Undoing photometry on all measurements in all images")
@@ -166,6 +317,27 @@ class PhotometryAllCommand(BaseCommand):
             cmd.undo()
 
 
+class _ProgressRelay(QObject):
+    """Carries a worker thread's progress and completion to the GUI thread
+
+    Created on the GUI thread, so signals emitted by the worker are queued
+    and handled there.
+    """
+
+    advanced = Signal()
+    done = Signal()
+
+    def __init__(self, prog, loop: QEventLoop):
+        super().__init__()
+        self.prog = prog
+        self.advanced.connect(self._on_advanced)
+        self.done.connect(loop.quit)
+
+    @Slot()
+    def _on_advanced(self):
+        self.prog.advance()
+
+
 class DifferentialPhotometryCommand(BaseCommand):
     """Command to perform differential photometry on measurements"""
 
@@ -29,9 +29,9 @@ class ProgressTask:
         return False
 
     def advance(self, n: int = 1):
-        """Advances current progress bar by n"""
-        if self._current + n < self._max:
-            self._current += n
+        """Advances current progress bar by n, up to its maximum"""
+        if self._current < self._max:
+            self._current = min(self._current + n, self._max)
             self.manager.changed.emit(self)
 
     @property
@@ -1,3 +1,5 @@
+import os
+
 from PySide6.QtCore import QObject, Signal
 
 
@@ -13,6 +15,10 @@ class BoxSelectParameters(OperatorParameters):
 class PhotometryParameters(OperatorParameters):
     mode = "all"
     images = "all"
+    execution = "parallel"  # or "serial", for all images
+    radii = "single"  # or "curve of growth"
+    growth_step = 0.5  # Pixel
+    jobs = os.cpu_count() or 1
     aperture_radius = 5
     annulus_inner_radius = 10
     annulus_outer_radius = 15
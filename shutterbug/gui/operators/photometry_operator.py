@@ -2,7 +2,9 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
-from PySide6.QtCore import Slot
+from math import isfinite
+
+from PySide6.QtCore import QPoint, QTimer, Slot
 from PySide6.QtGui import QMouseEvent, QUndoCommand
 
 from shutterbug.gui.commands.star_commands import (
@@ -10,6 +12,7 @@ from shutterbug.gui.commands.star_commands import (
     PhotometryMeasurementCommand,
 )
 from shutterbug.gui.operators.operator_parameters import PhotometryParameters
+from shutterbug.gui.operators.photometry_preview import PhotometryPreview
 from shutterbug.gui.tools.photometry_settings import PhotometryOperatorSettingsWidget
 
 if TYPE_CHECKING:
@@ -22,6 +25,9 @@ from shutterbug.core.models import MarkerType
 
 class PhotometryOperator(BaseOperator):
 
+    # Wait for panning and zooming to settle before previewing newly visible stars
+    VIEW_DEBOUNCE_DEFAULT = 100  # ms
+
     def __init__(
         self,
         viewer: ImageViewer,
@@ -33,8 +39,15 @@ class PhotometryOperator(BaseOperator):
         self.listening = True
         self.markers = {}  # (x, y) -> [markers]
         self.view = viewer.view
+        self.photometry_preview = PhotometryPreview(self)
+
+        self.view_timer = QTimer(self)
+        self.view_timer.setSingleShot(True)
+        self.view_timer.timeout.connect(self._request_photometry)
 
         self.params.changed.connect(self._on_params_changed)
+        self.photometry_preview.measured.connect(self._on_preview_measured)
+        self.view.view_changed.connect(self._on_view_changed)
 
     def create_settings_widget(self):
         """Creates settings widget for operator panel"""
@@ -82,6 +95,7 @@ class PhotometryOperator(BaseOperator):
                 2,
             )
             self.markers[(x, y)] = [aperture, annulus_inner, annulus_outer]
+        self._request_photometry()
 
     def stop_interaction(self):
         """Prevents interaction with operator"""
@@ -103,6 +117,9 @@ class PhotometryOperator(BaseOperator):
 
     def cleanup_preview(self):
         """Returns view to normal"""
+        self.view.view_changed.disconnect(self._on_view_changed)
+        self.view_timer.stop()
+        self.photometry_preview.shutdown()
         if self.view.current_image is None:
             return
 
@@ -129,8 +146,44 @@ class PhotometryOperator(BaseOperator):
             annulus_inner.radius = self.params.annulus_inner_radius
             annulus_outer.radius = self.params.annulus_outer_radius
 
+    def _request_photometry(self):
+        """Measures the stars in view in the background, for the overlay"""
+        image = self.view.current_image
+        if image is None or not self.markers:
+            return
+        rect = self.view.viewport_rect_to_scene(self.view.viewport().rect())
+        positions = [
+            (x, y) for x, y in self.markers if rect.contains(QPoint(int(x), int(y)))
+        ]
+        self.photometry_preview.request(
+            image,
+            positions,
+            self.params.aperture_radius,
+            self.params.annulus_inner_radius,
+            self.params.annulus_outer_radius,
+        )
+
+    @Slot(object)
+    def _on_preview_measured(self, results: dict):
+        """Shows previewed magnitudes and signal to noise beside the stars"""
+        for pos, (mag, snr) in results.items():
+            markers = self.markers.get(pos)
+            if markers is None:
+                continue
+            if isfinite(mag) and isfinite(snr):
+                markers[0].label = f"{mag:.2f} ({snr:.0f})"
+            else:
+                markers[0].label = "no signal"
+
+    @Slot()
+    def _on_view_changed(self):
+        """Previews the stars brought into view by panning or zooming"""
+        if self.markers:
+            self.view_timer.start(self.VIEW_DEBOUNCE_DEFAULT)
+
     @Slot()
     def _on_params_changed(self):
         """Handles parameters being changed"""
         if self.active:
             self._update_preview()
+            self._request_photometry()
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+if TYPE_CHECKING:
+    from shutterbug.core.models import FITSModel
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from math import ceil
+
+import numpy as np
+from PySide6.QtCore import QObject, QTimer, Signal, Slot
+
+import shutterbug.core.utility.photometry as phot
+
+
+class PhotometryPreview(QObject):
+    """Measures stars on a worker thread while photometry settings change
+
+    Requests are debounced and measured one at a time. A new request makes
+    older ones stale: they are dropped before starting, stop between chunks
+    of stars, and their results are never emitted. Cutouts around each star
+    are cached, so changing the radii only repeats the photometry.
+    """
+
+    # {(x, y): (magnitude, signal to noise)} for the latest request
+    measured = Signal(object)
+    _finished = Signal(int, object)
+
+    DEBOUNCE_DEFAULT = 150  # ms
+    CHUNK_SIZE_DEFAULT = 250  # stars between checks for stale requests
+    CUTOUT_MARGIN_DEFAULT = 5  # pixels beyond the outer annulus
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._executor: ThreadPoolExecutor | None = None
+        self._future: Future | None = None
+        self._pending = None
+        self._generation = 0
+
+        # Only touched by the worker thread holding the lock
+        self._lock = threading.Lock()
+        self._cutouts: Dict[Tuple[float, float], Tuple[np.ndarray, Tuple]] = {}
+        self._cutout_image = None
+        self._cutout_half_size = 0
+
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.timeout.connect(self._submit)
+        self._finished.connect(self._on_finished)
+
+    def request(
+        self,
+        image: FITSModel,
+        positions: List[Tuple[float, float]],
+        aperture_radius: float,
+        annulus_inner: float,
+        annulus_outer: float,
+    ):
+        """Schedules measuring the stars at positions on image"""
+        self._generation += 1
+        self._pending = (
+            self._generation,
+            image,
+            list(positions),
+            aperture_radius,
+            annulus_inner,
+            annulus_outer,
+        )
+        self.debounce_timer.start(self.DEBOUNCE_DEFAULT)
+
+    def cancel(self):
+        """Drops scheduled and running requests"""
+        self._generation += 1
+        self._pending = None
+        self.debounce_timer.stop()
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+
+    def shutdown(self):
+        """Cancels requests and stops the worker thread"""
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @Slot()
+    def _submit(self):
+        """Hands the latest request to the worker thread"""
+        if self._pending is None:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="photometry-preview"
+            )
+        if self._future is not None:
+            # Only succeeds if it has not started
+            self._future.cancel()
+        self._future = self._executor.submit(self._measure, *self._pending)
+        self._pending = None
+
+    @Slot(int, object)
+    def _on_finished(self, generation: int, results: dict):
+        """Passes on results that are still current"""
+        if generation == self._generation:
+            self.measured.emit(results)
+
+    def _measure(
+        self,
+        generation: int,
+        image: FITSModel,
+        positions: List[Tuple[float, float]],
+        aperture_radius: float,
+        annulus_inner: float,
+        annulus_outer: float,
+    ):
+        """Measures a request, on the worker thread"""
+        try:
+            with self._lock:
+                cutouts = self._get_cutouts(image, positions, annulus_outer)
+                results = {}
+                for start in range(0, len(positions), self.CHUNK_SIZE_DEFAULT):
+                    if generation != self._generation:
+                        logging.debug("Dropped stale photometry preview")
+                        return
+                    chunk = positions[start : start + self.CHUNK_SIZE_DEFAULT]
+                    mags, _, fluxes, flux_errors = phot.measure_cutouts(
+                        [cutouts[pos][0] for pos in chunk],
+                        [cutouts[pos][1] for pos in chunk],
+                        aperture_radius=aperture_radius,
+                        annulus_inner=annulus_inner,
+                        annulus_outer=annulus_outer,
+                    )
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        snr = np.where(fluxes > 0, fluxes / flux_errors, np.nan)
+                    results.update(zip(chunk, zip(mags.tolist(), snr.tolist())))
+            self._finished.emit(generation, results)
+        except Exception as e:
+            logging.error(f"Photometry preview failed: {type(e).__name__}: {e}")
+
+    def _get_cutouts(
+        self, image: FITSModel, positions: List[Tuple[float, float]], radius: float
+    ):
+        """Returns cached cutouts around positions, large enough for radius"""
+        if image.uid != self._cutout_image or radius + 1 > self._cutout_half_size:
+            # Leave room so small increases of the radius keep the cache
+            self._cutouts = {}
+            self._cutout_image = image.uid
+            self._cutout_half_size = ceil(radius) + self.CUTOUT_MARGIN_DEFAULT
+        for x, y in positions:
+            if (x, y) not in self._cutouts:
+                self._cutouts[(x, y)] = image.get_cutout(x, y, self._cutout_half_size)
+        return self._cutouts
@@ -1,3 +1,5 @@
+import os
+
 from PySide6.QtCore import Slot
 from PySide6.QtWidgets import QVBoxLayout
 from shutterbug.gui.controls import LabeledSlider, LabeledComboBox
@@ -16,6 +18,9 @@ class PhotometryOperatorSettingsWidget(BaseSettings):
         layout.setContentsMargins(0, 0, 0, 0)
         # self.mode = LabeledComboBox("Mode", ["all", "active"])
         self.images = LabeledComboBox("Images", ["all", "single"])
+        self.execution = LabeledComboBox("Execution", ["parallel", "serial"])
+        self.jobs = LabeledSlider("Workers", 1, os.cpu_count() or 1, self.params.jobs)
+        self.radii = LabeledComboBox("Radii", ["single", "curve of growth"])
         self.aperture = LabeledSlider(
             "Aperture",
             1,
@@ -43,12 +48,18 @@ class PhotometryOperatorSettingsWidget(BaseSettings):
 
         # self.mode.activated.connect(self._update_mode)
         self.images.activated.connect(self._update_images)
+        self.execution.activated.connect(self._update_execution)
+        self.jobs.valueChanged.connect(self._update_jobs)
+        self.radii.activated.connect(self._update_radii)
         self.aperture.valueChanged.connect(self._update_aperture)
         self.annulus_inner.valueChanged.connect(self._update_annulus_inner)
         self.annulus_outer.valueChanged.connect(self._update_annulus_outer)
 
         # layout.addWidget(self.mode)
         layout.addWidget(self.images)
+        layout.addWidget(self.execution)
+        layout.addWidget(self.jobs)
+        layout.addWidget(self.radii)
         layout.addWidget(self.aperture)
         layout.addWidget(self.annulus_inner)
         layout.addWidget(self.annulus_outer)
@@ -95,6 +106,24 @@ class PhotometryOperatorSettingsWidget(BaseSettings):
         self.params.images = value
         self.params.changed.emit()
 
+    @Slot(str)
+    def _update_execution(self, value: str):
+        """Updates execution parameter"""
+        self.params.execution = value
+        self.params.changed.emit()
+
+    @Slot(float)
+    def _update_jobs(self, value: float):
+        """Updates number of worker processes for parallel execution"""
+        self.params.jobs = int(value)
+        self.params.changed.emit()
+
+    @Slot(str)
+    def _update_radii(self, value: str):
+        """Updates radii parameter"""
+        self.params.radii = value
+        self.params.changed.emit()
+
 
 class PhotometryToolSettingsWidget(BaseSettings):
 
@@ -20,6 +20,7 @@ from PySide6.QtCore import (
     QRect,
     QTimer,
     Qt,
+    Signal,
     Slot,
 )
 from PySide6.QtGui import (
@@ -29,10 +30,19 @@ from PySide6.QtGui import (
     QMouseEvent,
     QPen,
     QPixmap,
+    QResizeEvent,
     QShowEvent,
     QWheelEvent,
 )
-from PySide6.QtWidgets import QGraphicsScene, QGraphicsView, QMenu, QVBoxLayout, QWidget
+from PySide6.QtWidgets import (
+    QGraphicsItem,
+    QGraphicsScene,
+    QGraphicsSimpleTextItem,
+    QGraphicsView,
+    QMenu,
+    QVBoxLayout,
+    QWidget,
+)
 
 from shutterbug.core.models import FITSModel
 from shutterbug.core.events.change_event import Event
@@ -214,6 +224,9 @@ class ImageViewer(BaseView):
 
 class ImageGraphicsView(QGraphicsView):
 
+    # Visible part of the scene moved, by panning, zooming or resizing
+    view_changed = Signal()
+
     # Zoom defaults
     ZOOM_FACTOR_DEFAULT = 1.1
     ZOOM_MAXIMUM_DEFAULT = 10.0
@@ -357,6 +370,7 @@ class ImageGraphicsView(QGraphicsView):
 
         # Fix box select region changing on zoom
         self.controller.tools.update_operation()
+        self.view_changed.emit()
 
     zoom = Property(float, get_zoom, set_zoom)
 
@@ -430,6 +444,16 @@ class ImageGraphicsView(QGraphicsView):
         if self.first_image and not self.pixmap_item.pixmap().isNull():
             QTimer.singleShot(0, self._delayed_fit)
 
+    @Slot(QResizeEvent)
+    def resizeEvent(self, event: QResizeEvent):
+        super().resizeEvent(event)
+        self.view_changed.emit()
+
+    def scrollContentsBy(self, dx: int, dy: int):
+        """Called when the view is panned"""
+        super().scrollContentsBy(dx, dy)
+        self.view_changed.emit()
+
     def update_display(self):
         """Updates image display"""
         if self.current_image is None:
@@ -517,6 +541,12 @@ class ImageGraphicsView(QGraphicsView):
             marker.rect,
             pen,
         )
+        if marker.label:
+            # Text stays the same size at any zoom, beside the circle
+            text = QGraphicsSimpleTextItem(marker.label, circle)
+            text.setBrush(marker.colour)
+            text.setPos(marker.x + marker.radius, marker.y - marker.radius)
+            text.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIgnoresTransformations)
         if not marker.visible:
             circle.hide()
 
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import logging
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from shutterbug.csv_loader import OBSERVATION_COLUMNS
+from shutterbug.utility import assign_sessions
+
+# Record of what an incremental run has already processed, kept in the
+# output directory. Bump the version when its fields change meaning.
+STATE_FILENAME = "incremental_state.json"
+STATE_VERSION = 1
+
+
+@dataclass
+class SessionRecord:
+    """Extent and content digest of one processed observation session"""
+
+    start_jd: float
+    end_jd: float
+    rows: int
+    digest: str
+
+
+def session_records(
+    data: pd.DataFrame, session_starts: np.ndarray
+) -> List[SessionRecord]:
+    """Summarise each observation session with a digest of its rows.
+
+    The digest is an order-independent sum of row hashes, so it changes
+    only when rows of the session are added, removed or edited, not when
+    the export is reordered.
+    """
+    sessions = assign_sessions(data["JD"].to_numpy(), session_starts)
+    hashes = pd.util.hash_pandas_object(
+        data[OBSERVATION_COLUMNS], index=False
+    ).to_numpy()
+    order = np.argsort(sessions, kind="stable")
+    rows = np.bincount(sessions, minlength=len(session_starts))
+    bounds = np.concatenate([[0], np.cumsum(rows)[:-1]])
+
+    records = []
+    if len(data):
+        # Sums wrap around at 2**64, which is fine for a digest
+        digests = np.add.reduceat(hashes[order], bounds)
+        end_jds = np.maximum.reduceat(data["JD"].to_numpy()[order], bounds)
+        for start, end, count, digest in zip(session_starts, end_jds, rows, digests):
+            records.append(
+                SessionRecord(float(start), float(end), int(count), f"{digest:016x}")
+            )
+    return records
+
+
+def reference_digest(names: List[str], reference_ids: List[str]) -> str:
+    """Digest of the reference set chosen for every target star."""
+    lines = (f"{name}\t{ids}" for name, ids in zip(names, reference_ids))
+    return hashlib.sha1("\n".join(lines).encode()).hexdigest()
+
+
+def load_state(output_dir: Path) -> Optional[dict]:
+    """Read the incremental state of an output directory, if there is one."""
+    path = Path(output_dir) / STATE_FILENAME
+    try:
+        state = json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable incremental state {path}: {e}")
+        return None
+    if state.get("version") != STATE_VERSION:
+        logging.info(f"Ignoring incremental state {path} from another version")
+        return None
+    return state
+
+
+def save_state(
+    output_dir: Path,
+    sessions: List[SessionRecord],
+    settings: dict,
+    references: str,
+    rows: int,
+):
+    """Record the sessions and rows processed into an output directory."""
+    path = Path(output_dir) / STATE_FILENAME
+    state = {
+        "version": STATE_VERSION,
+        "settings": settings,
+        "references": references,
+        "rows": rows,
+        "sessions": [asdict(record) for record in sessions],
+    }
+    # Replace atomically, so an interrupted write leaves the old state
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(json.dumps(state, indent=2))
+    temporary.replace(path)
+    logging.info(f"Recorded {len(sessions)} processed sessions in {path}")
+
+
+def plan_update(
+    state: Optional[dict],
+    sessions: List[SessionRecord],
+    settings: dict,
+    references: str,
+) -> Optional[List[int]]:
+    """Find the sessions that are new or changed since the recorded state.
+
+    Returns their session numbers, or None when everything has to be
+    processed again: without a state, after a change of settings or
+    reference stars, or when earlier sessions were split, merged or removed
+    so that session numbers no longer line up.
+    """
+    if state is None:
+        return None
+    if state["settings"] != settings:
+        logging.info("Processing settings changed, reprocessing all sessions")
+        return None
+    if state["references"] != references:
+        logging.info("Reference stars changed, reprocessing all sessions")
+        return None
+
+    previous = [SessionRecord(**record) for record in state["sessions"]]
+    if len(previous) > len(sessions) or any(
+        old.start_jd != new.start_jd for old, new in zip(previous, sessions)
+    ):
+        logging.info("Sessions no longer line up, reprocessing all sessions")
+        return None
+    return [
+        number
+        for number, record in enumerate(sessions)
+        if number >= len(previous) or record.digest != previous[number].digest
+    ]
@@ -0,0 +1,793 @@
+import glob
+import logging
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from shutterbug.csv_loader import (
+    load_cached_mirax_export,
+    load_mirax_export,
+    load_window,
+    partition_mirax_export,
+    scan_mirax_export,
+)
+from shutterbug.differential import (
+    calculate_all_differential_magnitudes,
+    calculate_weighted_differential_magnitudes,
+    reference_set_ids,
+)
+from shutterbug.graph import render_light_curves
+from shutterbug.incremental import (
+    load_state,
+    plan_update,
+    reference_digest,
+    save_state,
+    session_records,
+)
+from shutterbug.profiling import StageProfiler
+from shutterbug.progress_bars import ProgressBarManager
+from shutterbug.references import select_reference_stars
+from shutterbug.results import (
+    RESULT_COLUMNS,
+    merge_results_datasets,
+    write_results_dataset,
+)
+from shutterbug.utility import assign_sessions, find_session_starts, split_by_session
+from shutterbug.variability import rank_variability, select_candidates
+
+logger = logging.getLogger(__name__)
+
+# Rough peak memory per observation row, and per JD x star cell of the
+# differential engine's matrices, used to size out-of-core windows
+ROW_BYTES = 128
+CELL_BYTES = 64
+
+# Ranked variability table written to each output directory
+RANKING_FILENAME = "variability_ranking.csv"
+# Stage timing report, and cProfile stats of the slowest stage
+PROFILE_FILENAME = "profile.json"
+PROFILE_STATS_FILENAME = "profile_slowest.prof"
+
+# File types picked up when a directory is given as input
+DATA_FILE_PATTERNS = ["*.csv", "*.xlsx"]
+
+
+@dataclass
+class FileSummary:
+    """Outcome of processing a single data file"""
+
+    data_file: Path
+    measurements: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def find_data_files(inputs: Iterable[str]) -> List[Path]:
+    """Expand files, glob patterns and directories into a list of data files.
+
+    Raises FileNotFoundError for inputs that match nothing.
+    """
+    files = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            matches = sorted(
+                p for pattern in DATA_FILE_PATTERNS for p in path.glob(pattern)
+            )
+        elif path.exists():
+            matches = [path]
+        else:
+            matches = sorted(Path(p) for p in glob.glob(item, recursive=True))
+        if not matches:
+            raise FileNotFoundError(f"No data files found for {item}")
+        files.extend(matches)
+    # Drop repeats, keeping the first occurrence
+    return list(dict.fromkeys(files))
+
+
+def process_files(
+    data_files: List[Path],
+    output_dir: Path = Path("."),
+    jobs: int = 1,
+    results_file: Optional[Path] = None,
+    progress: Optional[ProgressBarManager] = None,
+    **options,
+) -> List[FileSummary]:
+    """Process many data files, one pipeline per file on a shared process pool.
+
+    A single file is processed in this process, with ``jobs`` processes used
+    for rendering. Otherwise each file gets its own subdirectory of
+    ``output_dir`` and the files are spread over ``jobs`` worker processes.
+    Each file's part of a shared results dataset is staged separately and
+    merged into ``results_dir`` once every file is done, so files with the
+    same sessions and stars do not replace each other's results. A failing
+    file is recorded in its summary without stopping the others. Progress
+    is shown per file in a batch, and per stage for a single file.
+    """
+    output_dir = Path(output_dir)
+    progress = progress or ProgressBarManager(enabled=False)
+    results_dir = options.pop("results_dir", None)
+    if len(data_files) == 1:
+        return [
+            process_file(
+                data_files[0],
+                output_dir,
+                results_file=results_file,
+                results_dir=results_dir,
+                jobs=jobs,
+                progress=progress,
+                **options,
+            )
+        ]
+
+    staging = None
+    if results_dir is not None:
+        # Next to the dataset, so staged files are moved rather than copied
+        Path(results_dir).mkdir(parents=True, exist_ok=True)
+        staging = Path(
+            tempfile.mkdtemp(
+                prefix=".shutterbug-staging-", dir=Path(results_dir).resolve().parent
+            )
+        )
+
+    tasks = []
+    used_names = set()
+    for data_file in data_files:
+        name = data_file.stem
+        while name in used_names:
+            name = f"{name}-{len(used_names)}"
+        used_names.add(name)
+        file_dir = output_dir / name
+        file_results = file_dir / Path(results_file).name if results_file else None
+        file_dataset = staging / name if staging is not None else None
+        tasks.append((data_file, file_dir, file_results, file_dataset))
+
+    summaries = {}
+    workers = min(jobs, len(tasks))
+    try:
+        with (
+            ProcessPoolExecutor(
+                max_workers=workers, initializer=init_worker
+            ) as executor,
+            progress.new("Files", "files", len(tasks), stage="Processing files") as bar,
+        ):
+            futures = {
+                executor.submit(
+                    process_file,
+                    data_file,
+                    file_dir,
+                    results_file=file_results,
+                    results_dir=file_dataset,
+                    **options,
+                ): data_file
+                for data_file, file_dir, file_results, file_dataset in tasks
+            }
+            for future in as_completed(futures):
+                summary = future.result()
+                summaries[futures[future]] = summary
+                if summary.ok:
+                    logger.debug(f"{summary.data_file}: done in {summary.seconds:.1f}s")
+                else:
+                    logger.warning(f"{summary.data_file}: FAILED, {summary.error}")
+                bar.update()
+        if staging is not None:
+            merge_results_datasets(
+                [
+                    file_dataset
+                    for data_file, _, _, file_dataset in tasks
+                    if summaries[data_file].ok
+                ],
+                results_dir,
+            )
+    finally:
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+    return [summaries[data_file] for data_file, _, _, _ in tasks]
+
+
+def process_file(
+    data_file: Path,
+    output_dir: Path = Path("."),
+    engine: str = "c",
+    chunksize: Optional[int] = None,
+    use_cache: bool = True,
+    rebuild_cache: bool = False,
+    references_file: Optional[Path] = None,
+    jobs: int = 1,
+    results_file: Optional[Path] = None,
+    results_dir: Optional[Path] = None,
+    memory_limit: Optional[int] = None,
+    incremental: bool = False,
+    ensemble: str = "mean",
+    clip_sigma: float = 3.0,
+    top_k: Optional[int] = None,
+    min_score: Optional[float] = None,
+    profile: bool = False,
+    profile_stats: bool = False,
+    progress: Optional[ProgressBarManager] = None,
+) -> FileSummary:
+    """Run the whole pipeline on one data file, capturing any failure.
+
+    With ``memory_limit`` the file is processed out of core, otherwise in
+    memory. With ``incremental`` only sessions that are new or changed since
+    the last incremental run into ``output_dir`` are processed. With
+    ``references_file`` its fixed reference stars are used. With
+    ``profile`` a stage timing report is written to the output directory,
+    and with ``profile_stats`` also cProfile stats of the slowest stage.
+    """
+    summary = FileSummary(Path(data_file))
+    profiler = StageProfiler(enabled=profile, cprofile=profile_stats)
+    start = time.perf_counter()
+    try:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        if incremental and memory_limit is not None:
+            raise ValueError("Incremental mode cannot be combined with a memory limit")
+        if rebuild_cache and memory_limit is not None:
+            raise ValueError("The cache cannot be rebuilt with a memory limit")
+        if memory_limit is not None:
+            summary.measurements = process_export_out_of_core(
+                data_file,
+                memory_limit,
+                engine=engine,
+                chunksize=chunksize or 1_000_000,
+                use_cache=use_cache,
+                references_file=references_file,
+                jobs=jobs,
+                results_file=results_file,
+                results_dir=results_dir,
+                output_dir=output_dir,
+                ensemble=ensemble,
+                clip_sigma=clip_sigma,
+                top_k=top_k,
+                min_score=min_score,
+                profiler=profiler,
+                progress=progress,
+            )
+        else:
+            process = process_export_incremental if incremental else process_export
+            diff_data = process(
+                data_file,
+                engine=engine,
+                chunksize=chunksize,
+                use_cache=use_cache,
+                rebuild_cache=rebuild_cache,
+                references_file=references_file,
+                jobs=jobs,
+                results_file=results_file,
+                results_dir=results_dir,
+                output_dir=output_dir,
+                ensemble=ensemble,
+                clip_sigma=clip_sigma,
+                top_k=top_k,
+                min_score=min_score,
+                profiler=profiler,
+                progress=progress,
+            )
+            summary.measurements = len(diff_data)
+    except Exception as e:
+        logger.exception(f"Failed to process {data_file}")
+        summary.error = f"{type(e).__name__}: {e}"
+    summary.seconds = time.perf_counter() - start
+
+    if profile:
+        try:
+            if profile_stats:
+                profiler.dump_slowest(Path(output_dir) / PROFILE_STATS_FILENAME)
+            profiler.write_report(
+                Path(output_dir) / PROFILE_FILENAME,
+                data_file=str(data_file),
+                out_of_core=memory_limit is not None,
+                incremental=incremental,
+                error=summary.error,
+            )
+        except OSError as e:
+            logger.warning(f"Unable to write profile for {data_file}: {e}")
+    return summary
+
+
+def init_worker():
+    """Set up logging in a batch worker process."""
+    logging.basicConfig(level=logging.INFO)
+
+
+def process_export(
+    data_file: Path,
+    engine: str = "c",
+    chunksize: Optional[int] = None,
+    use_cache: bool = True,
+    rebuild_cache: bool = False,
+    references_file: Optional[Path] = None,
+    jobs: int = 1,
+    results_file: Optional[Path] = None,
+    results_dir: Optional[Path] = None,
+    output_dir: Path = Path("."),
+    ensemble: str = "mean",
+    clip_sigma: float = 3.0,
+    top_k: Optional[int] = None,
+    min_score: Optional[float] = None,
+    profiler: Optional[StageProfiler] = None,
+    progress: Optional[ProgressBarManager] = None,
+) -> pd.DataFrame:
+    """Calculate and plot differential magnitudes for a whole Mirax export."""
+    profiler = profiler or StageProfiler(enabled=False)
+    progress = progress or ProgressBarManager(enabled=False)
+
+    # Load data
+    progress.set_stage("Loading")
+    data, metadata = _load_export(
+        data_file, engine, chunksize, use_cache, rebuild_cache, profiler
+    )
+    return process_observations(
+        data,
+        metadata,
+        use_cache=use_cache,
+        references_file=references_file,
+        jobs=jobs,
+        results_file=results_file,
+        results_dir=results_dir,
+        output_dir=output_dir,
+        ensemble=ensemble,
+        clip_sigma=clip_sigma,
+        top_k=top_k,
+        min_score=min_score,
+        profiler=profiler,
+        progress=progress,
+    )
+
+
+def process_observations(
+    data: pd.DataFrame,
+    metadata: pd.DataFrame,
+    use_cache: bool = True,
+    references_file: Optional[Path] = None,
+    jobs: int = 1,
+    results_file: Optional[Path] = None,
+    results_dir: Optional[Path] = None,
+    output_dir: Path = Path("."),
+    ensemble: str = "mean",
+    clip_sigma: float = 3.0,
+    top_k: Optional[int] = None,
+    min_score: Optional[float] = None,
+    profiler: Optional[StageProfiler] = None,
+    progress: Optional[ProgressBarManager] = None,
+) -> pd.DataFrame:
+    """Calculate and plot differential magnitudes for loaded observations.
+
+    ``data`` and ``metadata`` are shaped like the frames returned by
+    ``load_mirax_export``. Reference stars are read from ``references_file``
+    if given, otherwise selected through the reference cache unless
+    ``use_cache`` is False.
+    """
+    profiler = profiler or StageProfiler(enabled=False)
+    progress = progress or ProgressBarManager(enabled=False)
+
+    # Find reference stars for every target star
+    progress.set_stage("Selecting reference stars")
+    with profiler.stage("reference_selection") as stage:
+        names = metadata["Name"].tolist()
+        reference_indices = select_reference_stars(metadata, references_file, use_cache)
+        stage.rows = len(names)
+
+    # Calculate differential magnitudes for all target stars at once
+    logger.info(f"Calculating differential magnitudes for {len(names)} target stars")
+    progress.set_stage("Differential photometry")
+    with profiler.stage("differential") as stage:
+        diff_data = differential_magnitudes(
+            data, names, reference_indices, ensemble, clip_sigma
+        )
+        diff_data["reference_set"] = reference_sets(diff_data, names, reference_indices)
+        stage.rows = len(data)
+    logger.info("Differential magnitudes calculated successfully.")
+
+    # Split data by observation sessions
+    with profiler.stage("session_split") as stage:
+        diff_data = split_by_session(diff_data)
+        stage.rows = len(diff_data)
+    with profiler.stage("results_output") as stage:
+        if results_file is not None:
+            _write_results(diff_data, results_file, append=False)
+        if results_dir is not None:
+            write_results_dataset(diff_data, results_dir)
+        stage.rows = len(diff_data)
+
+    # Plot light curves of the most variable target stars in each session
+    _rank_and_plot(
+        diff_data,
+        output_dir,
+        jobs,
+        top_k,
+        min_score,
+        append=False,
+        profiler=profiler,
+        progress=progress,
+    )
+    return diff_data
+
+
+def process_export_incremental(
+    data_file: Path,
+    engine: str = "c",
+    chunksize: Optional[int] = None,
+    use_cache: bool = True,
+    rebuild_cache: bool = False,
+    references_file: Optional[Path] = None,
+    jobs: int = 1,
+    results_file: Optional[Path] = None,
+    results_dir: Optional[Path] = None,
+    output_dir: Path = Path("."),
+    ensemble: str = "mean",
+    clip_sigma: float = 3.0,
+    top_k: Optional[int] = None,
+    min_score: Optional[float] = None,
+    gap_threshold_days: float = 1.0,
+    profiler: Optional[StageProfiler] = None,
+    progress: Optional[ProgressBarManager] = None,
+) -> pd.DataFrame:
+    """Process only the sessions of an export that changed since the last run.
+
+    The sessions and rows processed are recorded in ``output_dir``. On the
+    next run, for example after a night was appended to a cumulative export,
+    differential magnitudes, rankings and plots are calculated only for new
+    or changed sessions and merged into the existing results files. With the
+    sidecar cache, only the appended rows of the export are parsed. Returns
+    the differential magnitudes that were calculated. The weighted ensemble
+    is not supported, as its reference means and clipping depend on every
+    session.
+    """
+    if ensemble == "weighted":
+        raise ValueError("The weighted ensemble needs the whole export at once")
+    profiler = profiler or StageProfiler(enabled=False)
+    progress = progress or ProgressBarManager(enabled=False)
+    output_dir = Path(output_dir)
+
+    progress.set_stage("Loading")
+    data, metadata = _load_export(
+        data_file, engine, chunksize, use_cache, rebuild_cache, profiler
+    )
+    with profiler.stage("reference_selection") as stage:
+        names = metadata["Name"].tolist()
+        reference_indices = select_reference_stars(metadata, references_file, use_cache)
+        stage.rows = len(names)
+
+    # Compare each session with what was processed last time
+    with profiler.stage("change_detection") as stage:
+        jd = data["JD"].to_numpy()
+        session_starts = find_session_starts(jd, gap_threshold_days)
+        sessions = session_records(data, session_starts)
+        settings = {
+            "ensemble": ensemble,
+            "clip_sigma": clip_sigma,
+            "gap_threshold_days": gap_threshold_days,
+            "top_k": top_k,
+            "min_score": min_score,
+            "results_file": None if results_file is None else str(results_file),
+            "results_dir": None if results_dir is None else str(results_dir),
+        }
+        references = reference_digest(
+            names, reference_set_ids(names, reference_indices).tolist()
+        )
+        state = load_state(output_dir)
+        stale = plan_update(state, sessions, settings, references)
+        stage.rows = len(data)
+
+    if stale is None:
+        stale = list(range(len(sessions)))
+        replaced = []
+        logger.info(f"Processing all {len(sessions)} sessions")
+    else:
+        replaced = [number for number in stale if number < len(state["sessions"])]
+        logger.info(
+            f"{len(stale) - len(replaced)} new and {len(replaced)} changed of "
+            f"{len(sessions)} sessions to process"
+        )
+    full = len(stale) == len(sessions)
+
+    diff_data = pd.DataFrame(columns=RESULT_COLUMNS)
+    if stale:
+        data = data[np.isin(assign_sessions(jd, session_starts), stale)]
+        progress.set_stage("Differential photometry")
+        with profiler.stage("differential") as stage:
+            diff_data = differential_magnitudes(
+                data, names, reference_indices, ensemble, clip_sigma
+            )
+            diff_data["reference_set"] = reference_sets(
+                diff_data, names, reference_indices
+            )
+            stage.rows = len(data)
+        del data
+
+        # Global session numbers, matching split_by_session on the whole export
+        with profiler.stage("session_split") as stage:
+            diff_data = diff_data.sort_values("JD").reset_index(drop=True)
+            diff_data["session"] = assign_sessions(diff_data["JD"], session_starts)
+            stage.rows = len(diff_data)
+
+        # Replace changed sessions and add new ones to the existing outputs
+        ranking_file = output_dir / RANKING_FILENAME
+        with profiler.stage("results_output") as stage:
+            if results_file is not None:
+                if replaced:
+                    drop_sessions(results_file, replaced)
+                _write_results(
+                    diff_data,
+                    results_file,
+                    append=not full and Path(results_file).exists(),
+                )
+            if results_dir is not None:
+                write_results_dataset(diff_data, results_dir)
+            if replaced:
+                drop_sessions(ranking_file, replaced)
+            stage.rows = len(diff_data)
+        _rank_and_plot(
+            diff_data,
+            output_dir,
+            jobs,
+            top_k,
+            min_score,
+            append=not full and ranking_file.exists(),
+            profiler=profiler,
+            progress=progress,
+        )
+    else:
+        logger.info("No new or changed sessions to process")
+
+    save_state(output_dir, sessions, settings, references, rows=len(jd))
+    return diff_data
+
+
+def process_export_out_of_core(
+    data_file: Path,
+    memory_limit: int,
+    engine: str = "c",
+    chunksize: int = 1_000_000,
+    use_cache: bool = True,
+    references_file: Optional[Path] = None,
+    jobs: int = 1,
+    results_file: Optional[Path] = None,
+    results_dir: Optional[Path] = None,
+    output_dir: Path = Path("."),
+    ensemble: str = "mean",
+    clip_sigma: float = 3.0,
+    top_k: Optional[int] = None,
+    min_score: Optional[float] = None,
+    gap_threshold_days: float = 1.0,
+    profiler: Optional[StageProfiler] = None,
+    progress: Optional[ProgressBarManager] = None,
+) -> int:
+    """Process a Mirax export in JD windows aligned to observation sessions.
+
+    The export is streamed twice: once for the spatial metadata and the
+    number of rows per JD, then to spill each window's observations to a
+    temporary file. Each window is then processed on its own with the same
+    reference stars, so peak memory scales with a window rather than the
+    whole campaign. Windows are sized to fit ``memory_limit`` bytes but never
+    split a session, so variability scores are unaffected, although
+    ``top_k`` applies to each window separately. Returns the number of
+    differential magnitudes written. The export is always read with
+    ``engine``, never from the sidecar cache, and pyarrow is not supported
+    as it cannot read in chunks. The weighted ensemble is not supported, as
+    its reference means and clipping depend on every window.
+    """
+    if ensemble == "weighted":
+        raise ValueError("The weighted ensemble needs the whole export at once")
+    if Path(data_file).suffix.lower() == ".xlsx":
+        raise ValueError("Out-of-core processing supports CSV exports only")
+    profiler = profiler or StageProfiler(enabled=False)
+    progress = progress or ProgressBarManager(enabled=False)
+
+    progress.set_stage("Scanning")
+    with profiler.stage("scan") as stage:
+        metadata, jd_counts = scan_mirax_export(
+            data_file, chunksize=chunksize, engine=engine
+        )
+        stage.rows = int(jd_counts.sum())
+    with profiler.stage("reference_selection") as stage:
+        names = metadata["Name"].tolist()
+        reference_indices = select_reference_stars(metadata, references_file, use_cache)
+        stage.rows = len(names)
+
+    session_starts = find_session_starts(jd_counts.index, gap_threshold_days)
+    window_starts = _plan_windows(jd_counts, len(names), session_starts, memory_limit)
+    logger.info(
+        f"Processing {len(session_starts)} sessions in {len(window_starts)} JD windows"
+    )
+
+    total = 0
+    with tempfile.TemporaryDirectory(prefix="shutterbug-") as spill_dir:
+        progress.set_stage("Partitioning")
+        with profiler.stage("partition") as stage:
+            paths = partition_mirax_export(
+                data_file,
+                names,
+                window_starts,
+                Path(spill_dir),
+                chunksize=chunksize,
+                engine=engine,
+            )
+            stage.rows = int(jd_counts.sum())
+        with progress.new("JD windows", "windows", len(paths)) as bar:
+            for window, path in enumerate(bar(paths)):
+                progress.set_stage("Differential photometry")
+                with profiler.stage("load") as stage:
+                    data = load_window(path, names)
+                    path.unlink()
+                    stage.rows = len(data)
+                if data.empty:
+                    continue
+                logger.debug(
+                    f"Processing JD window {window} with {len(data)} observations"
+                )
+                with profiler.stage("differential") as stage:
+                    diff_data = differential_magnitudes(
+                        data, names, reference_indices, ensemble, clip_sigma
+                    )
+                    diff_data["reference_set"] = reference_sets(
+                        diff_data, names, reference_indices
+                    )
+                    stage.rows = len(data)
+                del data
+
+                # Global session numbers, matching split_by_session on the export
+                with profiler.stage("session_split") as stage:
+                    diff_data = diff_data.sort_values("JD").reset_index(drop=True)
+                    diff_data["session"] = assign_sessions(
+                        diff_data["JD"], session_starts
+                    )
+                    stage.rows = len(diff_data)
+                with profiler.stage("results_output") as stage:
+                    if results_file is not None:
+                        _write_results(diff_data, results_file, append=total > 0)
+                    if results_dir is not None:
+                        write_results_dataset(diff_data, results_dir)
+                    stage.rows = len(diff_data)
+                _rank_and_plot(
+                    diff_data,
+                    output_dir,
+                    jobs,
+                    top_k,
+                    min_score,
+                    append=total > 0,
+                    profiler=profiler,
+                    progress=progress,
+                )
+                total += len(diff_data)
+
+    logger.info(f"Calculated {total} differential magnitudes out of core")
+    return total
+
+
+def _load_export(
+    data_file: Path,
+    engine: str,
+    chunksize: Optional[int],
+    use_cache: bool,
+    rebuild_cache: bool,
+    profiler: StageProfiler,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Load a Mirax export, through the sidecar cache if enabled."""
+    logger.info(f"Loading observation data from {data_file}")
+    with profiler.stage("load") as stage:
+        if use_cache:
+            data, metadata = load_cached_mirax_export(
+                data_file, engine=engine, chunksize=chunksize, rebuild=rebuild_cache
+            )
+        else:
+            data, metadata = load_mirax_export(
+                data_file, engine=engine, chunksize=chunksize
+            )
+        stage.rows = len(data)
+    logger.info("Data loaded successfully.")
+    return data, metadata
+
+
+def _plan_windows(
+    jd_counts: pd.Series,
+    n_stars: int,
+    session_starts: np.ndarray,
+    memory_limit: int,
+) -> np.ndarray:
+    """Group consecutive sessions into JD windows that fit the memory limit."""
+    session_ids = assign_sessions(jd_counts.index.to_numpy(), session_starts)
+    rows = np.bincount(session_ids, weights=jd_counts.to_numpy())
+    epochs = np.bincount(session_ids)
+    costs = rows * ROW_BYTES + epochs * n_stars * CELL_BYTES
+
+    window_starts = []
+    window_cost = np.inf
+    for start, cost in zip(session_starts, costs):
+        if cost > memory_limit:
+            logger.warning(
+                f"Session starting at JD {start:.5f} needs about "
+                f"{cost / 1024**2:.0f} MiB, more than the memory limit"
+            )
+        if window_cost + cost > memory_limit:
+            window_starts.append(start)
+            window_cost = 0
+        window_cost += cost
+    return np.asarray(window_starts, dtype=np.float64)
+
+
+def _rank_and_plot(
+    diff_data: pd.DataFrame,
+    output_dir: Path,
+    jobs: int,
+    top_k: Optional[int],
+    min_score: Optional[float],
+    append: bool,
+    profiler: StageProfiler,
+    progress: ProgressBarManager,
+):
+    """Rank light curves by variability and plot the selected candidates."""
+    progress.set_stage("Ranking variability")
+    with profiler.stage("variability_ranking") as stage:
+        ranking = rank_variability(diff_data)
+        ranking.to_csv(
+            Path(output_dir) / RANKING_FILENAME,
+            mode="a" if append else "w",
+            header=not append,
+            index=False,
+        )
+        stage.rows = len(diff_data)
+
+    with profiler.stage("plotting") as stage:
+        if top_k is not None or min_score is not None:
+            candidates = select_candidates(ranking, top_k=top_k, min_score=min_score)
+            keys = pd.MultiIndex.from_frame(candidates[["session", "Name"]])
+            selected = pd.MultiIndex.from_arrays(
+                [diff_data["session"], diff_data["Name"].astype(str)]
+            ).isin(keys)
+            logger.info(f"Plotting {len(candidates)} variable star candidates")
+            diff_data = diff_data[selected]
+        render_light_curves(
+            diff_data, output_dir=output_dir, jobs=jobs, progress=progress
+        )
+        stage.rows = len(diff_data)
+
+
+def differential_magnitudes(
+    data: pd.DataFrame,
+    names: List[str],
+    reference_indices: np.ndarray,
+    ensemble: str,
+    clip_sigma: float,
+) -> pd.DataFrame:
+    """Calculate differential magnitudes with the chosen ensemble mode."""
+    if ensemble == "weighted":
+        return calculate_weighted_differential_magnitudes(
+            data, names, reference_indices, clip_sigma=clip_sigma
+        )
+    if ensemble == "mean":
+        return calculate_all_differential_magnitudes(data, names, reference_indices)
+    raise ValueError(f"Unknown ensemble mode: {ensemble}")
+
+
+def reference_sets(
+    diff_data: pd.DataFrame, names: List[str], reference_indices: np.ndarray
+) -> pd.Categorical:
+    """Reference set identifier for each row of the differential results."""
+    ids = pd.Categorical(reference_set_ids(names, reference_indices))
+    return ids[diff_data["Name"].cat.codes.to_numpy()]
+
+
+def _write_results(df: pd.DataFrame, results_file: Path, append: bool):
+    """Write differential magnitudes to a CSV results file."""
+    df.to_csv(results_file, mode="a" if append else "w", header=not append, index=False)
+
+
+def drop_sessions(path: Path, sessions: List[int]):
+    """Remove the rows of some sessions from a CSV output file, if it exists."""
+    if not Path(path).exists():
+        return
+    df = pd.read_csv(path)
+    df[~df["session"].isin(sessions)].to_csv(path, index=False)
@@ -0,0 +1,143 @@
+import cProfile
+import json
+import logging
+import platform
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Generator, Optional
+
+# Bump when fields of the JSON report change meaning or are removed
+REPORT_FORMAT_VERSION = 1
+
+
+@dataclass
+class StageRecord:
+    """Timing and resource use of one pipeline stage"""
+
+    name: str
+    calls: int = 0
+    seconds: float = 0.0
+    rows: int = 0
+    peak_rss_bytes: Optional[int] = None
+
+    @property
+    def rows_per_second(self) -> Optional[float]:
+        return self.rows / self.seconds if self.seconds > 0 else None
+
+
+class StageProfiler:
+    """Times named pipeline stages and reports them as JSON.
+
+    A stage entered several times, such as once per out-of-core window, is
+    accumulated into one record. Peak RSS is reset at the start of each
+    stage where the platform allows it (Linux), otherwise it is the peak of
+    the process so far. With ``cprofile`` each stage is also run under
+    cProfile, which slows it down, and the slowest stage can be dumped.
+    """
+
+    def __init__(self, enabled: bool = True, cprofile: bool = False):
+        self.enabled = enabled
+        self.cprofile = cprofile and enabled
+        self.stages: Dict[str, StageRecord] = {}
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Generator[StageRecord, None, None]:
+        """Context manager timing one stage. Set ``rows`` on the record it yields."""
+        call = StageRecord(name, calls=1)
+        if not self.enabled:
+            yield call
+            return
+
+        _reset_peak_rss()
+        profile = self._profiles.setdefault(name, cProfile.Profile())
+        start = time.perf_counter()
+        if self.cprofile:
+            profile.enable()
+        try:
+            yield call
+        finally:
+            if self.cprofile:
+                profile.disable()
+            call.seconds = time.perf_counter() - start
+            call.peak_rss_bytes = _peak_rss()
+            self._accumulate(call)
+            logging.debug(f"Stage {name} took {call.seconds:.3f}s")
+
+    def _accumulate(self, call: StageRecord):
+        """Add one call of a stage to its running totals."""
+        total = self.stages.setdefault(call.name, StageRecord(call.name))
+        total.calls += call.calls
+        total.seconds += call.seconds
+        total.rows += call.rows
+        if call.peak_rss_bytes is not None:
+            total.peak_rss_bytes = max(total.peak_rss_bytes or 0, call.peak_rss_bytes)
+
+    def report(self, **context) -> dict:
+        """Build the JSON-serialisable report, with extra ``context`` fields."""
+        stages = []
+        for record in self.stages.values():
+            stage = asdict(record)
+            stage["rows_per_second"] = record.rows_per_second
+            stages.append(stage)
+        return {
+            "format_version": REPORT_FORMAT_VERSION,
+            "shutterbug_version": _shutterbug_version(),
+            "python_version": platform.python_version(),
+            "platform": platform.platform(),
+            "total_seconds": time.perf_counter() - self._start,
+            **context,
+            "stages": stages,
+        }
+
+    def write_report(self, path: Path, **context):
+        """Write the report as JSON."""
+        Path(path).write_text(json.dumps(self.report(**context), indent=2))
+        logging.info(f"Profile report written to {path}")
+
+    def dump_slowest(self, path: Path) -> Optional[str]:
+        """Write cProfile stats of the slowest stage, returning its name."""
+        if not self.cprofile or not self.stages:
+            return None
+        slowest = max(self.stages.values(), key=lambda record: record.seconds)
+        self._profiles[slowest.name].dump_stats(str(path))
+        logging.info(f"cProfile stats of stage {slowest.name} written to {path}")
+        return slowest.name
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak RSS counter for this process, where supported."""
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+
+def _peak_rss() -> Optional[int]:
+    """Peak resident set size of this process in bytes."""
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def _shutterbug_version() -> str:
+    """Installed version of shutterbug, if known."""
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("shutterbug")
+    except PackageNotFoundError:
+        return "unknown"
@@ -6,6 +6,14 @@ from contextlib import contextmanager
 
 @define
 class ProgressBarManager:
+    """Nested progress bars with a status bar showing the current stage.
+
+    Counters show items/sec and an ETA. The bars are turned off when
+    ``enabled`` is False or stdout is not a TTY, in which case counters
+    still work but draw nothing.
+    """
+
+    enabled: bool = True
     _manager: enlighten.Manager = field(init=False)
     _status: enlighten.StatusBar = field(init=False)
     _indentation: int = field(init=False, default=0)
@@ -15,7 +23,7 @@ class ProgressBarManager:
     _INDENTATION_TO_COLOR = {0: "white", 1: "blue", 2: "purple"}
 
     def __attrs_post_init__(self):
-        self._manager = enlighten.get_manager()  # type: ignore
+        self._manager = enlighten.get_manager(enabled=self.enabled)  # type: ignore
         self._status = self._manager.status_bar(
             status_format=self._STATUS_FORMAT,
             color=self._COLOR,
@@ -55,12 +63,21 @@ class ProgressBarManager:
         bar = self._make_counter(desc=desc, unit=unit, total=total)
         self._indentation += 1
         if stage is not None:
-            self._status.update(stage=stage)
+            self.set_stage(stage)
         try:
             yield bar
         finally:
+            self._indentation -= 1
             bar.close()
 
+    def set_stage(self, stage: str):
+        """Show what stage the program is in on the status bar"""
+        self._status.update(stage=stage)
+
+    def stop(self):
+        """Clear the bars and restore the terminal"""
+        self._manager.stop()
+
     def _make_counter(self, desc: str, unit: str, total: int) -> enlighten.Counter:
         """Makes a progress bar at a specific indentation and colour
 
@@ -81,10 +98,15 @@ class ProgressBarManager:
         """
 
         indentation = self._indentation
-        color = self._INDENTATION_TO_COLOR[indentation]
+        color = self._INDENTATION_TO_COLOR.get(indentation, "white")
         indented_desc = f"{' '*indentation}{desc}"
+        # Nested bars are recreated for every outer item, so do not keep them
         bar = self._manager.counter(
-            total=total, desc=indented_desc, unit=unit, color=color
+            total=total,
+            desc=indented_desc,
+            unit=unit,
+            color=color,
+            leave=indentation == 0,
         )
         bar.refresh()
         return bar  # type: ignore
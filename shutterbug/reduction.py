@@ -0,0 +1,305 @@
+import glob
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import repeat
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from shutterbug.core.utility import detection, photometry
+from shutterbug.csv_loader import EXPORT_DTYPES, OBSERVATION_COLUMNS, clean_data
+from shutterbug.pipeline import init_worker, process_observations
+from shutterbug.progress_bars import ProgressBarManager
+
+logger = logging.getLogger(__name__)
+
+# FITS file types picked up when a directory is given as input
+FITS_SUFFIXES = {".fits", ".fit", ".fts"}
+
+# Brightest stars used to find each frame's shift from the reference frame,
+# and the size in pixels of the bins the candidate shifts are voted into
+ALIGNMENT_STARS = 50
+ALIGNMENT_BIN = 2.0
+
+
+@dataclass
+class ReductionParameters:
+    """Detection, matching and photometry settings for a headless reduction"""
+
+    threshold: float = detection.THRESHOLD_DEFAULT
+    sigma: float = detection.SIGMA_DEFAULT
+    fwhm: float = detection.FWHM_DEFAULT
+    match_radius: float = 10.0  # pixels
+    aperture_radius: float = photometry.APERTURE_RADIUS_DEFAULT
+    annulus_inner: float = photometry.ANNULUS_INNER_DEFAULT
+    annulus_outer: float = photometry.ANNULUS_OUTER_DEFAULT
+    gain: float = photometry.GAIN_DEFAULT
+    read_noise: float = photometry.READ_NOISE_DEFAULT
+    zero_point: float = photometry.ZERO_POINT_DEFAULT
+    background: str = photometry.BACKGROUND_DEFAULT
+
+
+def find_frame_files(inputs: Iterable[str]) -> List[Path]:
+    """Expand FITS files, glob patterns and directories into a sorted list.
+
+    Raises FileNotFoundError for inputs that match nothing.
+    """
+    files = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            matches = [p for p in path.iterdir() if p.suffix.lower() in FITS_SUFFIXES]
+        elif path.exists():
+            matches = [path]
+        else:
+            matches = [Path(p) for p in glob.glob(item, recursive=True)]
+        if not matches:
+            raise FileNotFoundError(f"No FITS frames found for {item}")
+        files.extend(matches)
+    return sorted(set(files))
+
+
+def load_frame(path: Path) -> Tuple[np.ndarray, float]:
+    """Load the scaled image data and observation JD of a FITS frame."""
+    from astropy.io import fits
+
+    with fits.open(path, uint=True, memmap=True, do_not_scale_image_data=True) as hdul:
+        header = hdul[0].header  # type: ignore
+        bzero = header.get("BZERO", 0)
+        bscale = header.get("BSCALE", 1)
+        data = bzero + np.asarray(hdul[0].data, dtype=np.float64) * bscale  # type: ignore
+        if "JD" in header:
+            jd = float(header["JD"])
+        elif "DATE-OBS" in header:
+            from astropy.time import Time
+
+            jd = float(Time(header["DATE-OBS"], scale="utc").jd)
+        else:
+            raise ValueError(f"{path} has neither a JD nor a DATE-OBS header")
+    return data, jd
+
+
+def detect_stars(data: np.ndarray, params: ReductionParameters) -> np.ndarray:
+    """Positions of the stars found in a frame, brightest first."""
+    centroids = detection.find_centroids(
+        data, params.threshold, params.sigma, params.fwhm
+    )
+    if centroids is None or len(centroids) == 0:
+        return np.empty((0, 2))
+    order = np.argsort(-np.asarray(centroids["flux"]))
+    positions = np.column_stack(
+        [np.asarray(centroids["xcentroid"]), np.asarray(centroids["ycentroid"])]
+    )
+    return positions[order]
+
+
+def frame_offset(reference_xy: np.ndarray, frame_xy: np.ndarray) -> np.ndarray:
+    """Estimate how far a frame has drifted from the reference frame.
+
+    Every pairing of the brightest stars in both frames votes for a shift,
+    and the median of the shifts close to the most popular one is returned.
+    Unlike following the stars from frame to frame, this works on any frame
+    on its own, so frames can be reduced in parallel.
+    """
+    reference = reference_xy[:ALIGNMENT_STARS]
+    frame = frame_xy[:ALIGNMENT_STARS]
+    if not len(reference) or not len(frame):
+        return np.zeros(2)
+    shifts = (frame[:, None, :] - reference[None, :, :]).reshape(-1, 2)
+    cells, votes = np.unique(
+        np.round(shifts / ALIGNMENT_BIN), axis=0, return_counts=True
+    )
+    best = cells[np.argmax(votes)] * ALIGNMENT_BIN
+    close = np.all(np.abs(shifts - best) <= ALIGNMENT_BIN, axis=1)
+    return np.median(shifts[close], axis=0)
+
+
+def detect_reference_stars(
+    path: Path, params: ReductionParameters, max_stars: Optional[int] = None
+) -> Tuple[np.ndarray, pd.DataFrame]:
+    """Detect the stars to measure on a reference frame.
+
+    Returns their positions, brightest first, and metadata naming them
+    Star_1, Star_2, ... like the metadata of a Mirax export.
+    """
+    data, _ = load_frame(path)
+    reference_xy = detect_stars(data, params)[:max_stars]
+    if not len(reference_xy):
+        raise ValueError(f"No stars found on reference frame {path}")
+    metadata = pd.DataFrame(
+        {
+            "Name": [f"Star_{i + 1}" for i in range(len(reference_xy))],
+            "X": reference_xy[:, 0],
+            "Y": reference_xy[:, 1],
+        }
+    )
+    return reference_xy, metadata
+
+
+def reduce_frame(
+    path: Path, reference_xy: np.ndarray, params: ReductionParameters
+) -> pd.DataFrame:
+    """Find the reference stars on one frame and measure their magnitudes.
+
+    Returns one row per matched star, with its index in ``reference_xy``.
+    Stars without a detection within ``match_radius`` of their expected
+    position are left out, as when propagating stars in the GUI, and so are
+    stars whose detection is closer to another reference star.
+    """
+    data, jd = load_frame(path)
+    frame_xy = detect_stars(data, params)
+    predicted = reference_xy + frame_offset(reference_xy, frame_xy)
+    if len(frame_xy):
+        distances, nearest = cKDTree(frame_xy).query(
+            predicted, distance_upper_bound=params.match_radius
+        )
+        # Two reference stars may fall on one detection, keep the closest
+        stars = np.flatnonzero(np.isfinite(distances))
+        stars = stars[np.argsort(distances[stars], kind="stable")]
+        _, first = np.unique(nearest[stars], return_index=True)
+        stars = np.sort(stars[first])
+        positions = frame_xy[nearest[stars]]
+    else:
+        stars = np.empty(0, dtype=np.intp)
+        positions = np.empty((0, 2))
+
+    measurements = np.column_stack(
+        photometry.measure_star_magnitudes(
+            positions,
+            data,
+            aperture_radius=params.aperture_radius,
+            annulus_inner=params.annulus_inner,
+            annulus_outer=params.annulus_outer,
+            gain=params.gain,
+            read_noise=params.read_noise,
+            zero_point=params.zero_point,
+            background=params.background,
+        )
+    ).reshape(-1, 4)
+    logger.debug(f"Matched {len(stars)} of {len(reference_xy)} stars on {path}")
+    return pd.DataFrame(
+        {
+            "Star": stars,
+            "JD": jd,
+            "X": positions[:, 0],
+            "Y": positions[:, 1],
+            "Mag": measurements[:, 0],
+            "Error": measurements[:, 1],
+            "Flux": measurements[:, 2],
+        }
+    )
+
+
+def reduce_frames(
+    frame_files: List[Path],
+    output_dir: Path = Path("."),
+    params: Optional[ReductionParameters] = None,
+    reference_frame: Optional[Path] = None,
+    max_stars: Optional[int] = None,
+    jobs: int = 1,
+    photometry_file: Optional[Path] = None,
+    results_file: Optional[Path] = None,
+    results_dir: Optional[Path] = None,
+    ensemble: str = "mean",
+    clip_sigma: float = 3.0,
+    top_k: Optional[int] = None,
+    min_score: Optional[float] = None,
+    progress: Optional[ProgressBarManager] = None,
+) -> pd.DataFrame:
+    """Reduce FITS frames to differential light curves without the GUI.
+
+    Stars are detected on ``reference_frame``, by default the first frame,
+    and named Star_1, Star_2, ... from brightest to faintest. Every frame is
+    then aligned to it, matched and measured with aperture photometry on
+    ``jobs`` worker processes. The measurements go through the same
+    differential photometry, ranking and plotting as a Mirax export, and
+    can also be saved in the Mirax export format to ``photometry_file``.
+    Frames that fail are logged and skipped. Returns the differential
+    magnitudes.
+    """
+    params = params or ReductionParameters()
+    progress = progress or ProgressBarManager(enabled=False)
+    frame_files = [Path(f) for f in frame_files]
+    reference_frame = Path(reference_frame or frame_files[0])
+
+    logger.info(f"Detecting stars on reference frame {reference_frame}")
+    progress.set_stage("Detecting stars")
+    reference_xy, metadata = detect_reference_stars(reference_frame, params, max_stars)
+    names = metadata["Name"].tolist()
+
+    logger.info(
+        f"Measuring {len(names)} stars on {len(frame_files)} frames "
+        f"with {jobs} workers"
+    )
+    tasks = (frame_files, repeat(reference_xy), repeat(params))
+    with progress.new("Frames", "frames", len(frame_files), stage="Photometry") as bar:
+        if jobs > 1 and len(frame_files) > 1:
+            chunksize = max(1, len(frame_files) // (jobs * 4))
+            with ProcessPoolExecutor(
+                max_workers=jobs, initializer=init_worker
+            ) as executor:
+                frames = list(
+                    bar(executor.map(reduce_task, *tasks, chunksize=chunksize))
+                )
+        else:
+            frames = list(bar(map(reduce_task, *tasks)))
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        raise ValueError("None of the frames could be reduced")
+
+    measured = combine_frames(frames, names)
+    logger.info(
+        f"Measured {len(measured)} stars on {len(frames)} of "
+        f"{len(frame_files)} frames"
+    )
+    if photometry_file is not None:
+        measured.to_csv(photometry_file, index=False)
+        logger.info(f"Photometry written to {photometry_file}")
+
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    return process_observations(
+        frame_observations(measured),
+        metadata,
+        jobs=jobs,
+        results_file=results_file,
+        results_dir=results_dir,
+        output_dir=output_dir,
+        ensemble=ensemble,
+        clip_sigma=clip_sigma,
+        top_k=top_k,
+        min_score=min_score,
+        progress=progress,
+    )
+
+
+def combine_frames(frames: List[pd.DataFrame], names: List[str]) -> pd.DataFrame:
+    """Concatenate reduced frames, naming each star by its reference index."""
+    measured = pd.concat(frames, ignore_index=True)
+    measured.insert(
+        0, "Name", pd.Categorical.from_codes(measured.pop("Star"), categories=names)
+    )
+    return measured
+
+
+def frame_observations(measured: pd.DataFrame) -> pd.DataFrame:
+    """Observations of measured stars, cleaned like those of a Mirax export."""
+    return clean_data(
+        measured[OBSERVATION_COLUMNS].astype(
+            {col: EXPORT_DTYPES[col] for col in ["Mag", "JD", "Error"]}
+        )
+    )
+
+
+def reduce_task(
+    path: Path, reference_xy: np.ndarray, params: ReductionParameters
+) -> Optional[pd.DataFrame]:
+    """Reduce one frame, logging and skipping it if it fails."""
+    try:
+        return reduce_frame(path, reference_xy, params)
+    except Exception as e:
+        logger.error(f"Failed to reduce {path}: {type(e).__name__}: {e}")
+        return None
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from shutterbug.differential import find_all_reference_stars, reference_index_array
+
+logger = logging.getLogger(__name__)
+
+# Reference selections are cached per user, so every export of the same
+# field reuses them. Bump the version when the selection rules change.
+REFERENCE_CACHE_VERSION = 1
+REFERENCE_FILE_COLUMNS = ["Name", "Reference"]
+
+
+def reference_cache_dir() -> Path:
+    """Directory of cached reference selections, under the user cache."""
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "shutterbug" / "references"
+
+
+def selection_key(
+    metadata: pd.DataFrame,
+    max_distance: Optional[float] = None,
+    min_refs: int = 10,
+    max_refs: int = 50,
+) -> str:
+    """Digest of everything the reference selection depends on."""
+    digest = hashlib.sha1()
+    digest.update(
+        f"{REFERENCE_CACHE_VERSION}\t{max_distance}\t{min_refs}\t{max_refs}".encode()
+    )
+    digest.update("\n".join(metadata["Name"].astype(str)).encode())
+    digest.update(metadata[["X", "Y"]].to_numpy(dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def cached_reference_stars(
+    metadata: pd.DataFrame,
+    cache_dir: Optional[Path] = None,
+    max_distance: Optional[float] = None,
+    min_refs: int = 10,
+    max_refs: int = 50,
+) -> np.ndarray:
+    """``find_all_reference_stars``, reusing selections saved in ``cache_dir``.
+
+    Selections are stored keyed by ``selection_key``, so they are reused for
+    any export with the same stars at the same positions. Without
+    ``cache_dir`` the references are selected every time.
+    """
+    if cache_dir is None:
+        return find_all_reference_stars(metadata, max_distance, min_refs, max_refs)
+
+    path = Path(cache_dir) / (
+        selection_key(metadata, max_distance, min_refs, max_refs) + ".npy"
+    )
+    try:
+        reference_indices = np.load(path)
+        if len(reference_indices) == len(metadata):
+            logger.info(f"Loaded cached reference star selection from {path}")
+            return reference_indices
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable reference star cache {path}: {e}")
+
+    reference_indices = find_all_reference_stars(
+        metadata, max_distance, min_refs, max_refs
+    )
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Replace atomically, so concurrent runs never read a partial file
+        temporary = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary, "wb") as f:
+            np.save(f, reference_indices)
+        temporary.replace(path)
+    except OSError as e:
+        logger.warning(f"Unable to cache reference star selection in {path}: {e}")
+    return reference_indices
+
+
+def save_reference_sets(
+    path: Path, metadata: pd.DataFrame, reference_indices: np.ndarray
+):
+    """Write each target's reference stars to a CSV, nearest first.
+
+    The file has one row per target and reference, so it can be edited by
+    hand or in a spreadsheet and loaded with ``load_reference_sets``.
+    """
+    names = metadata["Name"].astype(str).to_numpy()
+    targets, ranks = np.nonzero(reference_indices >= 0)
+    pd.DataFrame(
+        {
+            "Name": names[targets],
+            "Reference": names[reference_indices[targets, ranks]],
+        }
+    ).to_csv(path, index=False)
+    logger.info(f"Reference stars for {len(names)} targets written to {path}")
+
+
+def load_reference_sets(
+    path: Path, metadata: pd.DataFrame, use_cache: bool = True
+) -> np.ndarray:
+    """Read fixed reference stars saved by ``save_reference_sets``.
+
+    Returns the same padded index array as ``find_all_reference_stars`` for
+    the stars in ``metadata``. References that were not observed are left
+    out, and targets missing from the file get automatically selected
+    references.
+    """
+    fixed = pd.read_csv(path, usecols=REFERENCE_FILE_COLUMNS, dtype=str)
+    names = metadata["Name"].astype(str).tolist()
+    observed = fixed["Reference"].isin(names)
+    if not observed.all():
+        logger.warning(
+            f"{fixed.loc[~observed, 'Reference'].nunique()} reference stars in "
+            f"{path} were not observed and are left out"
+        )
+    groups = fixed[observed].groupby("Name", sort=False)["Reference"]
+    reference_stars = {
+        name: [ref for ref in refs if ref != name] for name, refs in groups
+    }
+
+    missing = [i for i, name in enumerate(names) if name not in reference_stars]
+    if missing:
+        logger.warning(
+            f"{len(missing)} of {len(names)} targets have no references in "
+            f"{path}, selecting them automatically"
+        )
+        selected = select_reference_stars(metadata, use_cache=use_cache)
+        for i in missing:
+            reference_stars[names[i]] = [names[j] for j in selected[i] if j >= 0]
+    logger.info(f"Using fixed reference stars from {path}")
+    return reference_index_array(names, [reference_stars[name] for name in names])
+
+
+def select_reference_stars(
+    metadata: pd.DataFrame,
+    references_file: Optional[Path] = None,
+    use_cache: bool = True,
+) -> np.ndarray:
+    """Reference stars for every target, as used by the pipeline.
+
+    Read from ``references_file`` if given, otherwise selected by position
+    through the user's reference cache unless ``use_cache`` is False.
+    """
+    if references_file is not None:
+        return load_reference_sets(references_file, metadata, use_cache=use_cache)
+    return cached_reference_stars(
+        metadata, cache_dir=reference_cache_dir() if use_cache else None
+    )
@@ -0,0 +1,118 @@
+import logging
+import shutil
+import uuid
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+# Columns stored in a results dataset, partitioned by session and star
+RESULT_COLUMNS = [
+    "Name",
+    "JD",
+    "session",
+    "differential_magnitude",
+    "differential_error",
+    "reference_set",
+]
+PARTITION_COLUMNS = ["session", "Name"]
+
+# JD of the Unix epoch, used to label sessions by calendar date
+UNIX_EPOCH_JD = 2440587.5
+
+
+def session_labels(df: pd.DataFrame) -> pd.Series:
+    """Label each row's session with the UTC date it started on.
+
+    Unlike session numbers, which restart with every export, the date a
+    session started on identifies it across runs.
+    """
+    start_jd = df.groupby("session")["JD"].transform("min")
+    days = np.floor(start_jd.to_numpy() - UNIX_EPOCH_JD).astype("int64")
+    return pd.Series(
+        days.astype("datetime64[D]").astype(str), index=df.index, name="session"
+    )
+
+
+def write_results_dataset(df: pd.DataFrame, path: Path, replace: bool = True):
+    """Write differential magnitudes to a Parquet dataset.
+
+    The dataset is hive-partitioned by session start date and star name.
+    Partitions present in ``df`` are replaced, all others are left untouched,
+    so later nights append without rewriting earlier ones. Without
+    ``replace``, rows are added to existing partitions instead. Requires
+    pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    df = df.assign(session=session_labels(df), Name=df["Name"].astype(str))
+    table = pa.Table.from_pandas(df[RESULT_COLUMNS], preserve_index=False)
+    ds.write_dataset(
+        table,
+        Path(path),
+        format="parquet",
+        partitioning=_partitioning(),
+        existing_data_behavior="delete_matching" if replace else "overwrite_or_ignore",
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+    )
+    logging.info(f"Wrote {len(df)} differential magnitudes to {path}")
+
+
+def merge_results_datasets(sources: Iterable[Path], path: Path):
+    """Move the results datasets in ``sources`` into the dataset at ``path``.
+
+    Partitions of ``path`` present in any source are deleted first, once,
+    so sources that share a session and star are all kept, as when they
+    were written as one. The sources are removed.
+    """
+    sources = [Path(source) for source in sources if Path(source).exists()]
+    path = Path(path)
+    files = [(source, file) for source in sources for file in source.rglob("*.parquet")]
+    partitions = {file.parent.relative_to(source) for source, file in files}
+    for partition in partitions:
+        shutil.rmtree(path / partition, ignore_errors=True)
+    for source, file in files:
+        # File names are unique to each write, so none are overwritten
+        destination = path / file.relative_to(source)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(file, destination)
+    for source in sources:
+        shutil.rmtree(source, ignore_errors=True)
+    logging.info(f"Merged {len(files)} result files into {path}")
+
+
+def read_results_dataset(
+    path: Path,
+    stars: Optional[Iterable[str]] = None,
+    sessions: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """Read differential magnitudes back from a Parquet dataset.
+
+    Filtering by star or session date only reads the matching partitions.
+    """
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(Path(path), format="parquet", partitioning=_partitioning())
+    condition = None
+    for column, values in (("Name", stars), ("session", sessions)):
+        if values is None:
+            continue
+        expression = ds.field(column).isin(list(values))
+        condition = expression if condition is None else condition & expression
+    table = dataset.to_table(filter=condition)
+    if table.num_rows == 0:
+        # An empty dataset has no columns to select
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    df = table.to_pandas()[RESULT_COLUMNS]
+    return df.sort_values(["Name", "JD"], ignore_index=True)
+
+
+def _partitioning():
+    """Hive partitioning by session and star, both read back as strings."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    schema = pa.schema([(column, pa.string()) for column in PARTITION_COLUMNS])
+    return ds.partitioning(schema, flavor="hive")
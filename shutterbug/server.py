@@ -0,0 +1,384 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from shutterbug.results import RESULT_COLUMNS, read_results_dataset
+from shutterbug.variability import (
+    RANKING_COLUMNS,
+    rank_variability,
+    select_candidates,
+)
+
+logger = logging.getLogger(__name__)
+
+JSON_TYPE = "application/json"
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+
+
+class QueryError(ValueError):
+    """A query that cannot be answered, with the HTTP status to reply with"""
+
+    def __init__(self, message: str, status: HTTPStatus = HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+def load_results(path: Path) -> pd.DataFrame:
+    """Load differential results from a results CSV or a results dataset."""
+    path = Path(path)
+    if path.is_dir():
+        return read_results_dataset(path)
+    df = pd.read_csv(path)
+    return df[[column for column in RESULT_COLUMNS if column in df.columns]]
+
+
+def source_fingerprint(path: Path) -> Tuple:
+    """Size and modification time of every file the results are read from."""
+    path = Path(path)
+    files = sorted(path.rglob("*.parquet")) if path.is_dir() else [path]
+    fingerprint = []
+    for file in files:
+        try:
+            stat = file.stat()
+        except FileNotFoundError:
+            continue
+        fingerprint.append((str(file), stat.st_size, stat.st_mtime_ns))
+    return tuple(fingerprint)
+
+
+class ResultsIndex:
+    """Differential results held in memory, indexed for queries.
+
+    Rows are sorted by star and JD, so a star's curve is a contiguous slice
+    and a JD range within it is found by binary search. A second ordering
+    by JD answers JD range and session queries across all stars, as every
+    session is a contiguous JD range. The variability ranking is computed
+    once on load.
+    """
+
+    def __init__(self, results: pd.DataFrame):
+        results = results.assign(
+            Name=results["Name"].astype(str), session=results["session"].astype(str)
+        )
+        self.results = results.sort_values(["Name", "JD"], ignore_index=True)
+        names = self.results["Name"].to_numpy()
+        self.jd = self.results["JD"].to_numpy()
+
+        stars, starts, counts = np.unique(names, return_index=True, return_counts=True)
+        self.star_rows: Dict[str, Tuple[int, int]] = {
+            star: (int(start), int(start + count))
+            for star, start, count in zip(stars, starts, counts)
+        }
+        self.jd_order = np.argsort(self.jd, kind="stable")
+        self.jd_sorted = self.jd[self.jd_order]
+
+        self.sessions = (
+            self.results.groupby("session")
+            .agg(
+                start_jd=("JD", "min"),
+                end_jd=("JD", "max"),
+                stars=("Name", "nunique"),
+                observations=("JD", "size"),
+            )
+            .sort_values("start_jd")
+            .reset_index()
+        )
+        self.session_bounds = {
+            row.session: (row.start_jd, row.end_jd)
+            for row in self.sessions.itertuples()
+        }
+        self.ranking = pd.DataFrame(columns=RANKING_COLUMNS)
+        if len(self.results):
+            self.ranking = rank_variability(
+                self.results.astype({"Name": "category"})
+            ).astype({"Name": str})
+
+    def stars(self) -> pd.DataFrame:
+        """Every star with its number of observations."""
+        return pd.DataFrame(
+            {
+                "Name": list(self.star_rows),
+                "observations": [
+                    stop - start for start, stop in self.star_rows.values()
+                ],
+            }
+        )
+
+    def curve(
+        self,
+        star: str,
+        session: Optional[str] = None,
+        jd_min: Optional[float] = None,
+        jd_max: Optional[float] = None,
+    ) -> pd.DataFrame:
+        """One star's light curve, optionally limited to a session or JD range."""
+        if star not in self.star_rows:
+            raise QueryError(f"Unknown star: {star}", HTTPStatus.NOT_FOUND)
+        start, stop = self.star_rows[star]
+        jd_min, jd_max = self._jd_range(session, jd_min, jd_max)
+        jd = self.jd[start:stop]
+        low = start + np.searchsorted(jd, jd_min, side="left")
+        high = start + np.searchsorted(jd, jd_max, side="right")
+        return self.results.iloc[low:high]
+
+    def observations(
+        self,
+        session: Optional[str] = None,
+        jd_min: Optional[float] = None,
+        jd_max: Optional[float] = None,
+    ) -> pd.DataFrame:
+        """Every star's observations in a session or JD range, by JD."""
+        if session is None and jd_min is None and jd_max is None:
+            raise QueryError("Give a session, jd_min or jd_max")
+        jd_min, jd_max = self._jd_range(session, jd_min, jd_max)
+        low = np.searchsorted(self.jd_sorted, jd_min, side="left")
+        high = np.searchsorted(self.jd_sorted, jd_max, side="right")
+        return self.results.iloc[self.jd_order[low:high]]
+
+    def _jd_range(
+        self,
+        session: Optional[str],
+        jd_min: Optional[float],
+        jd_max: Optional[float],
+    ) -> Tuple[float, float]:
+        """Intersect a session's JD range with the requested one."""
+        low, high = -np.inf, np.inf
+        if session is not None:
+            if session not in self.session_bounds:
+                raise QueryError(f"Unknown session: {session}", HTTPStatus.NOT_FOUND)
+            low, high = self.session_bounds[session]
+        if jd_min is not None:
+            low = max(low, jd_min)
+        if jd_max is not None:
+            high = min(high, jd_max)
+        return low, high
+
+
+class ResultsService:
+    """Answers queries about a results file, reloading it when it changes.
+
+    The source is checked at most every ``check_interval`` seconds. When its
+    files have changed the index is rebuilt and the response cache, holding
+    up to ``cache_size`` encoded responses, is cleared. A failed reload
+    keeps serving the previous results.
+    """
+
+    def __init__(
+        self, source: Path, check_interval: float = 2.0, cache_size: int = 1024
+    ):
+        self.source = Path(source)
+        self.check_interval = check_interval
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._cache: OrderedDict = OrderedDict()
+        self._checked_at = 0.0
+        self._fingerprint = source_fingerprint(self.source)
+        self.index = ResultsIndex(load_results(self.source))
+        self.version = self._version()
+        logger.info(
+            f"Serving {len(self.index.results)} differential magnitudes of "
+            f"{len(self.index.star_rows)} stars from {self.source}"
+        )
+
+    def refresh(self):
+        """Reload the results if their files changed since the last check."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        # Reloading holds its own lock, so cached queries are answered meanwhile
+        with self._reload_lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            fingerprint = source_fingerprint(self.source)
+            if fingerprint == self._fingerprint:
+                return
+            try:
+                index = ResultsIndex(load_results(self.source))
+            except Exception as e:
+                logger.warning(f"Keeping previous results, reload failed: {e}")
+                return
+            self._fingerprint = fingerprint
+            with self._lock:
+                self.index = index
+                self.version = self._version()
+                self._cache.clear()
+            logger.info(f"Reloaded {len(index.results)} rows from {self.source}")
+
+    def query(self, path: str, params: Dict[str, str]) -> Tuple[bytes, str]:
+        """Encoded response body and content type for a query."""
+        self.refresh()
+        key = (self.version, path, tuple(sorted(params.items())))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        params = dict(params)
+        response_format = params.pop("format", "json")
+        if response_format not in ("json", "arrow"):
+            raise QueryError(f"Unknown format: {response_format}")
+        response = _encode(self._answer(path, params), response_format)
+
+        with self._lock:
+            if key[0] == self.version and self.cache_size > 0:
+                self._cache[key] = response
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return response
+
+    def _answer(self, path: str, params: Dict[str, str]) -> pd.DataFrame:
+        """Run a query against the current index."""
+        index = self.index
+        session = params.pop("session", None)
+        if path == "/stars":
+            return index.stars()
+        if path == "/sessions":
+            return index.sessions
+        if path == "/ranking":
+            ranking = index.ranking
+            if session is not None and len(ranking):
+                ranking = ranking[ranking["session"] == session]
+            return select_candidates(
+                ranking,
+                top_k=_number(params, "top_k", int),
+                min_score=_number(params, "min_score", float),
+            )
+        if path == "/curve":
+            if "star" not in params:
+                raise QueryError("Missing parameter: star")
+            return index.curve(
+                params["star"],
+                session=session,
+                jd_min=_number(params, "jd_min", float),
+                jd_max=_number(params, "jd_max", float),
+            )
+        if path == "/observations":
+            return index.observations(
+                session=session,
+                jd_min=_number(params, "jd_min", float),
+                jd_max=_number(params, "jd_max", float),
+            )
+        raise QueryError(f"Unknown path: {path}", HTTPStatus.NOT_FOUND)
+
+    def _version(self) -> str:
+        """Identifier of the loaded results, used as the ETag."""
+        return hashlib.sha1(repr(self._fingerprint).encode()).hexdigest()[:16]
+
+
+class ResultsRequestHandler(BaseHTTPRequestHandler):
+    """GET handler answering queries from the server's ``ResultsService``"""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which Nagle's algorithm would
+    # hold back on keep-alive connections until the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        service = self.server.service  # type: ignore
+        if "format" not in params and ARROW_TYPE in self.headers.get("Accept", ""):
+            params["format"] = "arrow"
+        try:
+            body, content_type = service.query(url.path.rstrip("/") or "/", params)
+        except QueryError as e:
+            self._reply(e.status, json.dumps({"error": str(e)}).encode(), JSON_TYPE)
+            return
+        except Exception as e:
+            logger.exception(f"Failed to answer {self.path}")
+            error = json.dumps({"error": f"{type(e).__name__}: {e}"}).encode()
+            self._reply(HTTPStatus.INTERNAL_SERVER_ERROR, error, JSON_TYPE)
+            return
+
+        etag = f'"{service.version}"'
+        if self.headers.get("If-None-Match") == etag:
+            self._reply(HTTPStatus.NOT_MODIFIED, b"", None, etag)
+        else:
+            self._reply(HTTPStatus.OK, body, content_type, etag)
+
+    def _reply(
+        self,
+        status: HTTPStatus,
+        body: bytes,
+        content_type: Optional[str],
+        etag: Optional[str] = None,
+    ):
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header("Content-Type", content_type)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Per-request logging is debug only, to keep it off the hot path
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class ResultsServer(ThreadingHTTPServer):
+    """Threaded HTTP server for a ``ResultsService``"""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: ResultsService):
+        super().__init__(address, ResultsRequestHandler)
+        self.service = service
+
+
+def serve(
+    source: Path,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    check_interval: float = 2.0,
+    cache_size: int = 1024,
+):
+    """Serve queries about a results file or dataset until interrupted."""
+    service = ResultsService(source, check_interval, cache_size)
+    with ResultsServer((host, port), service) as server:
+        host, port = server.server_address[:2]
+        logger.info(f"Listening on http://{host}:{port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Stopped serving")
+
+
+def _number(params: Dict[str, str], name: str, kind):
+    """Parse an optional numeric query parameter."""
+    if name not in params:
+        return None
+    try:
+        return kind(params[name])
+    except ValueError:
+        raise QueryError(f"Invalid {name}: {params[name]}")
+
+
+def _encode(df: pd.DataFrame, response_format: str) -> Tuple[bytes, str]:
+    """Encode a query result as JSON records or an Arrow IPC stream."""
+    if response_format == "json":
+        return df.to_json(orient="records", double_precision=15).encode(), JSON_TYPE
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise QueryError("Arrow responses require pyarrow", HTTPStatus.NOT_ACCEPTABLE)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes(), ARROW_TYPE
@@ -0,0 +1,197 @@
+import logging
+from pathlib import Path
+from typing import List
+
+import click
+import numpy as np
+import pandas as pd
+
+# Epochs written per CSV block, to keep memory flat for large exports
+EPOCHS_PER_BLOCK = 50
+
+
+def generate_mirax_export(
+    file_path: Path,
+    n_stars: int = 1000,
+    n_epochs: int = 100,
+    n_sessions: int = 2,
+    noise: float = 0.01,
+    missing_fraction: float = 0.02,
+    n_variables: int = 10,
+    session_length: float = 0.3,
+    session_spacing: float = 2.0,
+    field_size: float = 2048.0,
+    seed: int = 0,
+) -> List[str]:
+    """Write a synthetic Mirax-shaped CSV export.
+
+    Stars are scattered over a ``field_size`` square field with magnitudes
+    between 10 and 16 and photometric errors growing towards the faint end.
+    The epochs are split evenly into ``n_sessions`` sessions lasting
+    ``session_length`` days, starting ``session_spacing`` days apart.
+    ``missing_fraction`` of the rows are dropped and the same fraction
+    again get an empty magnitude. ``n_variables`` stars get sinusoidal
+    variability. Rows are written frame by frame, like the real exports.
+
+    Returns the names of the injected variable stars.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([f"Star {i:05d}" for i in range(n_stars)])
+    x = rng.uniform(0, field_size, n_stars)
+    y = rng.uniform(0, field_size, n_stars)
+    base_mags = rng.uniform(10, 16, n_stars)
+    errors = noise * 10 ** (0.2 * (base_mags - 10))
+
+    # Sinusoidal variables with periods from about an hour to half a day
+    variables = rng.choice(n_stars, size=min(n_variables, n_stars), replace=False)
+    amplitudes = np.zeros(n_stars)
+    periods = np.ones(n_stars)
+    phases = np.zeros(n_stars)
+    amplitudes[variables] = rng.uniform(0.05, 0.5, len(variables))
+    periods[variables] = rng.uniform(0.05, 0.5, len(variables))
+    phases[variables] = rng.uniform(0, 2 * np.pi, len(variables))
+
+    # Epochs spread evenly over the sessions
+    session_ids = np.arange(n_epochs) * n_sessions // max(n_epochs, 1)
+    offsets = np.concatenate(
+        [
+            np.sort(rng.uniform(0, session_length, np.sum(session_ids == s)))
+            for s in range(n_sessions)
+        ]
+    )
+    jd = 2460000.6 + session_ids * session_spacing + offsets
+
+    logging.info(
+        f"Writing synthetic export with {n_stars} stars and {n_epochs} epochs "
+        f"to {file_path}"
+    )
+    header = True
+    for start in range(0, n_epochs, EPOCHS_PER_BLOCK):
+        block_jd = jd[start : start + EPOCHS_PER_BLOCK]
+        n_rows = len(block_jd) * n_stars
+        star = np.tile(np.arange(n_stars), len(block_jd))
+        times = np.repeat(block_jd, n_stars)
+
+        signal = amplitudes[star] * np.sin(
+            2 * np.pi * times / periods[star] + phases[star]
+        )
+        mags = base_mags[star] + signal + rng.normal(0, errors[star])
+        # Small per-frame zero-point drift, as from changing airmass
+        mags += np.repeat(rng.normal(0, 0.05, len(block_jd)), n_stars)
+
+        block = pd.DataFrame(
+            {
+                "Name": names[star],
+                "JD": times,
+                "X": x[star] + rng.normal(0, 0.5, n_rows),
+                "Y": y[star] + rng.normal(0, 0.5, n_rows),
+                "Mag": mags,
+                "Error": errors[star],
+                "Flux": 10 ** (-0.4 * (mags - 25)),
+                "SNR": 1.0857 / errors[star],
+            }
+        )
+        block = block[rng.random(n_rows) >= missing_fraction]
+        block.loc[rng.random(len(block)) < missing_fraction, "Mag"] = np.nan
+        block.to_csv(file_path, mode="w" if header else "a", header=header, index=False)
+        header = False
+
+    return names[variables].tolist()
+
+
+def generate_fits_frames(
+    directory: Path,
+    n_stars: int = 200,
+    n_frames: int = 20,
+    size: int = 512,
+    fwhm: float = 3.0,
+    drift: float = 0.5,
+    background: float = 1000.0,
+    n_variables: int = 5,
+    start_jd: float = 2460000.6,
+    cadence: float = 0.005,
+    seed: int = 0,
+) -> List[Path]:
+    """Write a series of synthetic FITS frames of one field.
+
+    Stars with Gaussian profiles sit on a flat ``background`` with Poisson
+    noise, and the field drifts by ``drift`` pixels per frame in x and y.
+    ``n_variables`` stars get sinusoidal variability. Frames are 16-bit
+    unsigned images with a JD header keyword, like camera output. Returns
+    the paths of the frames written.
+    """
+    from astropy.io import fits
+
+    rng = np.random.default_rng(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    margin = 20 + drift * n_frames
+    x = rng.uniform(margin, size - margin, n_stars)
+    y = rng.uniform(margin, size - margin, n_stars)
+    fluxes = 10 ** rng.uniform(3.5, 5.5, n_stars)
+    variables = rng.choice(n_stars, size=min(n_variables, n_stars), replace=False)
+    amplitudes = np.zeros(n_stars)
+    amplitudes[variables] = 0.3
+
+    sigma = fwhm / 2.3548
+    half = int(np.ceil(4 * sigma))
+    offsets = np.arange(-half, half + 1)
+    paths = []
+    for frame in range(n_frames):
+        jd = start_jd + frame * cadence
+        image = np.full((size, size), background)
+        shift = frame * drift
+        scale = 1 + amplitudes * np.sin(2 * np.pi * frame / max(n_frames, 1))
+        for sx, sy, flux in zip(x + shift, y + shift, fluxes * scale):
+            cx, cy = int(round(sx)), int(round(sy))
+            gx = np.exp(-0.5 * ((cx + offsets - sx) / sigma) ** 2)
+            gy = np.exp(-0.5 * ((cy + offsets - sy) / sigma) ** 2)
+            stamp = flux * np.outer(gy, gx) / (2 * np.pi * sigma**2)
+            image[cy - half : cy + half + 1, cx - half : cx + half + 1] += stamp
+        image = np.clip(rng.poisson(image), 0, 65535).astype(np.uint16)
+
+        header = fits.Header()
+        header["JD"] = jd
+        path = directory / f"frame_{frame:04d}.fits"
+        fits.PrimaryHDU(image, header=header).writeto(path, overwrite=True)
+        paths.append(path)
+    logging.info(f"Wrote {n_frames} synthetic frames to {directory}")
+    return paths
+
+
+@click.command()
+@click.argument("output", type=click.Path(dir_okay=False))
+@click.option("--stars", default=1000, show_default=True, help="Number of stars.")
+@click.option("--epochs", default=100, show_default=True, help="Number of epochs.")
+@click.option("--sessions", default=2, show_default=True, help="Number of sessions.")
+@click.option(
+    "--noise", default=0.01, show_default=True, help="Error of the brightest stars."
+)
+@click.option(
+    "--missing",
+    default=0.02,
+    show_default=True,
+    help="Fraction of missing rows, and again of empty magnitudes.",
+)
+@click.option(
+    "--variables", default=10, show_default=True, help="Number of variable stars."
+)
+@click.option("--seed", default=0, show_default=True, help="Random seed.")
+def main(output, stars, epochs, sessions, noise, missing, variables, seed):
+    """Write a synthetic Mirax export to OUTPUT for testing and benchmarking."""
+    logging.basicConfig(level=logging.INFO)
+    injected = generate_mirax_export(
+        output,
+        n_stars=stars,
+        n_epochs=epochs,
+        n_sessions=sessions,
+        noise=noise,
+        missing_fraction=missing,
+        n_variables=variables,
+        seed=seed,
+    )
+    click.echo(f"Injected variables: {', '.join(injected)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 
@@ -13,3 +14,15 @@ def split_by_session(df, gap_threshold_days=1.0):
     df["session"] = session_breaks.cumsum()
 
     return df
+
+
+def find_session_starts(jd, gap_threshold_days=1.0):
+    """Find the first JD of each observation session, as split_by_session does."""
+    jd = np.unique(np.asarray(jd, dtype=np.float64))
+    breaks = np.diff(jd) > gap_threshold_days
+    return np.concatenate([jd[:1], jd[1:][breaks]])
+
+
+def assign_sessions(jd, session_starts):
+    """Label each JD with the index of the session it falls in."""
+    return np.maximum(np.searchsorted(session_starts, jd, side="right") - 1, 0)
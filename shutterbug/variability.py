@@ -0,0 +1,135 @@
+import logging
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Statistics combined into the variability score, and the sign that makes
+# larger values more variable
+SCORE_STATISTICS = {"reduced_chi2": 1, "stetson_j": 1, "von_neumann": -1}
+
+# Columns of a variability ranking, one row per session and star
+RANKING_COLUMNS = [
+    "session",
+    "Name",
+    "n",
+    "weighted_mean",
+    "weighted_rms",
+    "reduced_chi2",
+    "stetson_j",
+    "stetson_k",
+    "von_neumann",
+    "score",
+]
+
+
+def variability_statistics(df: pd.DataFrame) -> pd.DataFrame:
+    """Calculate variability statistics for each star in each session.
+
+    Takes differential results with Name, JD, session, differential_magnitude
+    and differential_error columns, and returns one row per session and star
+    with the number of observations, weighted mean and RMS, reduced chi
+    squared against a constant, Stetson J and K, and the von Neumann ratio.
+    All stars are handled together with per-group sums, without a Python
+    loop over stars. Observations whose magnitude or error is not finite, or
+    whose error is not positive, are left out, and ``n`` counts the rest.
+    """
+    df = df.sort_values(["session", "Name", "JD"])
+    sessions = df["session"].to_numpy()
+    codes = df["Name"].cat.codes.to_numpy()
+    mags = df["differential_magnitude"].to_numpy(dtype=np.float64)
+    errors = df["differential_error"].to_numpy(dtype=np.float64)
+
+    # Group id per row, increasing in (session, Name) order
+    starts = np.r_[True, (sessions[1:] != sessions[:-1]) | (codes[1:] != codes[:-1])]
+    starts = starts[: len(df)]
+    group = np.cumsum(starts) - 1
+    n_groups = group[-1] + 1 if len(group) else 0
+
+    # Leave out unusable rows before any sums, keeping every group
+    usable = np.isfinite(mags) & np.isfinite(errors) & (errors > 0)
+    group, mags, errors = group[usable], mags[usable], errors[usable]
+
+    def group_sum(values, rows=slice(None)):
+        return np.bincount(group[rows], weights=values, minlength=n_groups)
+
+    # Consecutive observations of the same star in the same session
+    paired = group[1:] == group[:-1]
+    pair_rows = np.flatnonzero(paired)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        count = np.bincount(group, minlength=n_groups)
+        # Groups without usable observations get no statistics at all
+        n = np.where(count > 0, count, np.nan)
+        weights = 1.0 / errors**2
+        weighted_mean = group_sum(weights * mags) / group_sum(weights)
+        residuals = mags - weighted_mean[group]
+        weighted_rms = np.sqrt(group_sum(weights * residuals**2) / group_sum(weights))
+        reduced_chi2 = group_sum((residuals / errors) ** 2) / (n - 1)
+
+        # Stetson (1996) indices, pairing consecutive observations for J
+        deltas = np.sqrt(n / (n - 1))[group] * residuals / errors
+        products = deltas[pair_rows] * deltas[pair_rows + 1]
+        stetson_j = group_sum(
+            np.sign(products) * np.sqrt(np.abs(products)), pair_rows
+        ) / (n - 1)
+        stetson_k = (group_sum(np.abs(deltas)) / n) / np.sqrt(group_sum(deltas**2) / n)
+
+        # von Neumann ratio, mean square successive difference over variance
+        mean = group_sum(mags) / n
+        variance = group_sum((mags - mean[group]) ** 2) / (n - 1)
+        successive = np.diff(mags)[pair_rows] ** 2
+        von_neumann = group_sum(successive, pair_rows) / (n - 1) / variance
+
+    first = df.iloc[np.flatnonzero(starts)]
+    return pd.DataFrame(
+        {
+            "session": first["session"].to_numpy(),
+            "Name": first["Name"].to_numpy(),
+            "n": count.astype(np.int64),
+            "weighted_mean": weighted_mean,
+            "weighted_rms": weighted_rms,
+            "reduced_chi2": reduced_chi2,
+            "stetson_j": stetson_j,
+            "stetson_k": stetson_k,
+            "von_neumann": von_neumann,
+        }
+    )
+
+
+def rank_variability(df: pd.DataFrame) -> pd.DataFrame:
+    """Rank every star in every session by a combined variability score.
+
+    The score is the mean of robust z-scores, within each session, of log
+    reduced chi squared, Stetson J and negative log von Neumann ratio. It
+    reads as "deviations more variable than a typical star in the field".
+    """
+    stats = variability_statistics(df)
+    z_scores = []
+    for column, sign in SCORE_STATISTICS.items():
+        values = stats[column]
+        if column != "stetson_j":
+            values = np.log10(values.where(values > 0))
+        values = sign * values
+        by_session = values.groupby(stats["session"])
+        median = by_session.transform("median")
+        mad = (values - median).abs().groupby(stats["session"]).transform("median")
+        z_scores.append((values - median) / (1.4826 * mad.where(mad > 0)))
+    stats["score"] = pd.concat(z_scores, axis=1).mean(axis=1)
+
+    ranking = stats.sort_values("score", ascending=False, na_position="last")
+    logging.info(f"Ranked {len(ranking)} light curves by variability")
+    return ranking.reset_index(drop=True)
+
+
+def select_candidates(
+    ranking: pd.DataFrame,
+    top_k: Optional[int] = None,
+    min_score: Optional[float] = None,
+) -> pd.DataFrame:
+    """Select the most variable light curves from a ranking."""
+    if min_score is not None:
+        ranking = ranking[ranking["score"] >= min_score]
+    if top_k is not None:
+        ranking = ranking.head(top_k)
+    return ranking
@@ -0,0 +1,343 @@
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from shutterbug.csv_loader import concat_chunks, load_appended_rows
+from shutterbug.graph import render_light_curves
+from shutterbug.pipeline import (
+    RANKING_FILENAME,
+    differential_magnitudes,
+    drop_sessions,
+    reference_sets,
+)
+from shutterbug.reduction import (
+    FITS_SUFFIXES,
+    ReductionParameters,
+    combine_frames,
+    detect_reference_stars,
+    frame_observations,
+    reduce_task,
+)
+from shutterbug.references import select_reference_stars
+from shutterbug.results import write_results_dataset
+from shutterbug.utility import assign_sessions, find_session_starts
+from shutterbug.variability import rank_variability, select_candidates
+
+logger = logging.getLogger(__name__)
+
+# Mirax exports and FITS frames picked up in a watched directory
+WATCH_PATTERNS = ["*.csv"] + [f"*{suffix}" for suffix in sorted(FITS_SUFFIXES)]
+
+# Subdirectory of the output directory for the light curves of FITS frames
+FRAMES_OUTPUT = "frames"
+
+# Bytes hashed at the start and end of what has been read of an export, to
+# tell rows being appended from the file being rewritten in place
+DIGEST_BYTES = 4096
+
+
+@dataclass
+class WatchedExport:
+    """What has been read of one export in a watched directory"""
+
+    path: Path
+    output_dir: Path
+    offset: int = 0
+    digest: str = ""
+    inode: int = -1
+    size: int = -1
+    mtime_ns: int = -1
+    changed_at: float = 0.0
+    pending: bool = False
+    data: Optional[pd.DataFrame] = None
+    metadata: Optional[pd.DataFrame] = None
+    reference_indices: Optional[np.ndarray] = None
+
+
+@dataclass
+class WatchedFrames:
+    """What has been measured of the FITS frames in a watched directory"""
+
+    output_dir: Path
+    reference_xy: Optional[np.ndarray] = None
+    data: Optional[pd.DataFrame] = None
+    metadata: Optional[pd.DataFrame] = None
+    reference_indices: Optional[np.ndarray] = None
+
+
+class ExportWatcher:
+    """Follows the Mirax exports in a directory and updates their results live.
+
+    Each export's observations, spatial metadata and reference stars stay in
+    memory between updates. An update only parses the rows appended since
+    the previous one, recalculates the sessions those rows fall in, and
+    re-plots the stars that gained observations. A file is picked up once it
+    has not changed for ``debounce`` seconds. A file that shrinks, or whose
+    rows already read change, was rewritten and is read again from the start. Each export gets its own subdirectory of
+    ``output_dir``. Reference stars come from ``references_file`` if given.
+
+    FITS frames in the directory are treated as one series of the same
+    field, written to the ``frames`` subdirectory. Stars are detected on the
+    first frame to settle, limited to the ``max_stars`` brightest, and each
+    new frame is reduced with ``reduction`` settings as by ``reduce_frames``
+    before updating the series like an export that gained rows.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        output_dir: Path = Path("."),
+        results_dir: Optional[Path] = None,
+        engine: str = "c",
+        references_file: Optional[Path] = None,
+        ensemble: str = "mean",
+        clip_sigma: float = 3.0,
+        top_k: Optional[int] = None,
+        min_score: Optional[float] = None,
+        jobs: int = 1,
+        gap_threshold_days: float = 1.0,
+        debounce: float = 2.0,
+        reduction: Optional[ReductionParameters] = None,
+        max_stars: Optional[int] = None,
+    ):
+        if ensemble == "weighted":
+            raise ValueError("The weighted ensemble needs the whole export at once")
+        self.directory = Path(directory)
+        self.output_dir = Path(output_dir)
+        self.results_dir = results_dir
+        self.engine = engine
+        self.references_file = references_file
+        self.ensemble = ensemble
+        self.clip_sigma = clip_sigma
+        self.top_k = top_k
+        self.min_score = min_score
+        self.jobs = jobs
+        self.gap_threshold_days = gap_threshold_days
+        self.debounce = debounce
+        self.reduction = reduction or ReductionParameters()
+        self.max_stars = max_stars
+        self.exports: Dict[Path, WatchedExport] = {}
+        self.frames = WatchedFrames(self.output_dir / FRAMES_OUTPUT)
+
+    def scan(self) -> List[WatchedExport]:
+        """Check the directory, returning exports whose changes have settled."""
+        now = time.monotonic()
+        ready = []
+        paths = sorted(
+            p for pattern in WATCH_PATTERNS for p in self.directory.glob(pattern)
+        )
+        for path in paths:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            export = self.exports.get(path)
+            if export is None or stat.st_ino != export.inode:
+                export = WatchedExport(path, self.output_dir / path.stem)
+                self.exports[path] = export
+            elif stat.st_size < export.offset or (
+                export.offset
+                and stat.st_mtime_ns != export.mtime_ns
+                and _read_digest(path, export.offset) != export.digest
+            ):
+                logger.info(f"{path.name} was rewritten, reading it again")
+                export = WatchedExport(path, self.output_dir / path.stem)
+                self.exports[path] = export
+
+            if (stat.st_ino, stat.st_size, stat.st_mtime_ns) != (
+                export.inode,
+                export.size,
+                export.mtime_ns,
+            ):
+                export.inode = stat.st_ino
+                export.size = stat.st_size
+                export.mtime_ns = stat.st_mtime_ns
+                export.changed_at = now
+                export.pending = True
+            elif export.pending and now - export.changed_at >= self.debounce:
+                ready.append(export)
+        return ready
+
+    def update(self, export: WatchedExport) -> int:
+        """Load an export's new rows and update its results from them.
+
+        Returns the number of new observations.
+        """
+        start = time.perf_counter()
+        new_data, new_metadata, export.offset = load_appended_rows(
+            export.path, export.offset, engine=self.engine
+        )
+        export.digest = _read_digest(export.path, export.offset)
+        export.pending = False
+        if new_data.empty:
+            return 0
+        plotted = self._update_results(export, new_data, new_metadata)
+        logger.info(
+            f"Updated {export.path.name} with {len(new_data)} new rows and "
+            f"{plotted} light curves in {time.perf_counter() - start:.2f}s"
+        )
+        return len(new_data)
+
+    def update_frames(self, frames: List[WatchedExport]) -> int:
+        """Reduce new FITS frames and update the frame series from them.
+
+        Returns the number of new observations.
+        """
+        start = time.perf_counter()
+        for frame in frames:
+            frame.pending = False
+        series = self.frames
+        if series.reference_xy is None:
+            logger.info(f"Detecting stars on reference frame {frames[0].path}")
+            series.reference_xy, series.metadata = detect_reference_stars(
+                frames[0].path, self.reduction, self.max_stars
+            )
+        reduced = [
+            reduce_task(frame.path, series.reference_xy, self.reduction)
+            for frame in frames
+        ]
+        reduced = [r for r in reduced if r is not None]
+        if not reduced:
+            return 0
+        names = series.metadata["Name"].tolist()
+        new_data = frame_observations(combine_frames(reduced, names))
+        if new_data.empty:
+            return 0
+        plotted = self._update_results(series, new_data, series.metadata)
+        logger.info(
+            f"Updated frames with {len(reduced)} new frames and "
+            f"{plotted} light curves in {time.perf_counter() - start:.2f}s"
+        )
+        return len(new_data)
+
+    def _update_results(
+        self,
+        export: Union[WatchedExport, WatchedFrames],
+        new_data: pd.DataFrame,
+        new_metadata: pd.DataFrame,
+    ) -> int:
+        """Merge new observations into an export's state and update its results.
+
+        Returns the number of light curves plotted.
+        """
+        # Merge into the warm state, re-selecting references for new stars
+        if export.data is None:
+            export.data = new_data
+            export.metadata = new_metadata
+        else:
+            export.data = concat_chunks([export.data, new_data])
+            export.data = export.data.drop_duplicates(subset=["Name", "JD"])
+            export.metadata = pd.concat(
+                [export.metadata, new_metadata], ignore_index=True
+            ).drop_duplicates(subset=["Name"])
+        names = export.metadata["Name"].tolist()
+        known = export.reference_indices
+        if known is None or len(known) != len(names):
+            export.reference_indices = select_reference_stars(
+                export.metadata, self.references_file
+            )
+
+        # Recalculate the sessions the new rows fall in
+        jd = export.data["JD"].to_numpy()
+        session_starts = find_session_starts(jd, self.gap_threshold_days)
+        affected = np.unique(assign_sessions(new_data["JD"].to_numpy(), session_starts))
+        rows = export.data[np.isin(assign_sessions(jd, session_starts), affected)]
+        diff_data = differential_magnitudes(
+            rows, names, export.reference_indices, self.ensemble, self.clip_sigma
+        )
+        diff_data["reference_set"] = reference_sets(
+            diff_data, names, export.reference_indices
+        )
+        diff_data = diff_data.sort_values("JD").reset_index(drop=True)
+        diff_data["session"] = assign_sessions(diff_data["JD"], session_starts)
+
+        export.output_dir.mkdir(parents=True, exist_ok=True)
+        if self.results_dir is not None:
+            write_results_dataset(diff_data, self.results_dir)
+        ranking = rank_variability(diff_data)
+        ranking_file = export.output_dir / RANKING_FILENAME
+        drop_sessions(ranking_file, affected.tolist())
+        exists = ranking_file.exists()
+        ranking.to_csv(
+            ranking_file, mode="a" if exists else "w", header=not exists, index=False
+        )
+
+        # Re-plot the stars that gained observations
+        candidates = select_candidates(
+            ranking, top_k=self.top_k, min_score=self.min_score
+        )
+        candidates = candidates[
+            candidates["Name"].isin(new_data["Name"].astype(str).unique())
+        ]
+        keys = pd.MultiIndex.from_frame(candidates[["session", "Name"]])
+        selected = pd.MultiIndex.from_arrays(
+            [diff_data["session"], diff_data["Name"].astype(str)]
+        ).isin(keys)
+        return render_light_curves(
+            diff_data[selected], output_dir=export.output_dir, jobs=self.jobs
+        )
+
+    def poll(self) -> int:
+        """Scan once and update every settled export, returning how many.
+
+        New FITS frames count as one update of the frame series.
+        """
+        updated = 0
+        frames = []
+        for export in self.scan():
+            if export.path.suffix.lower() in FITS_SUFFIXES:
+                frames.append(export)
+                continue
+            try:
+                self.update(export)
+                updated += 1
+            except Exception:
+                logger.exception(f"Failed to update {export.path}")
+        if frames:
+            try:
+                self.update_frames(frames)
+                updated += 1
+            except Exception:
+                logger.exception(f"Failed to update frames in {self.directory}")
+        return updated
+
+    def run(self, interval: float = 1.0):
+        """Poll the directory every ``interval`` seconds until interrupted."""
+        _warm_up()
+        logger.info(f"Watching {self.directory} for Mirax exports and FITS frames")
+        try:
+            while True:
+                self.poll()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching")
+
+
+def _read_digest(path: Path, offset: int) -> str:
+    """Hash of the start and end of the first ``offset`` bytes of a file.
+
+    Appending rows leaves it unchanged, so a different hash means that the
+    part already read was rewritten. Empty if the file cannot be read.
+    """
+    digest = hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            digest.update(f.read(min(offset, DIGEST_BYTES)))
+            f.seek(max(offset - DIGEST_BYTES, 0))
+            digest.update(f.read(min(offset, DIGEST_BYTES)))
+    except OSError:
+        return ""
+    return digest.hexdigest()
+
+
+def _warm_up():
+    """Import the plotting and time libraries now, not on the first update."""
+    import astropy.time  # noqa: F401
+    import matplotlib.backends.backend_agg  # noqa: F401
+    import matplotlib.dates  # noqa: F401